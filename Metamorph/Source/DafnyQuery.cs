@@ -8,7 +8,7 @@ namespace Synthesis;
 public class DafnyQuery {
 
   public const string ReceiverName = "receiver"; // the name of the object being modified/constructed
-  private const string ArgumentNamePrefix = "argument_"; // method arguments' names start with this prefix
+  public const string ArgumentNamePrefix = "argument_"; // method arguments' names start with this prefix
   public const string DefaultMethodName = "synthesized"; // method that forms the Dafny query will have this name
   
   private static int nextId = 0; 
@@ -1,3 +1,4 @@
+using System.Text.Json;
 using System.Text.RegularExpressions;
 using CommandLine;
 using DafnyTestGeneration;
@@ -18,14 +19,14 @@ public abstract class Driver {
       .AddJsonFile("appsettings.json", optional: true, reloadOnChange: true)
       .Build();
     LogManager.Configuration = new NLogLoggingConfiguration(config.GetSection("NLog"));
-    GlobalDiagnosticsContext.Set("startTime", DateTime.Now.ToString("yyyy-MM-dd_HH:mm:ss"));
+    GlobalDiagnosticsContext.Set("startTime", DateTime.Now.ToString("yyyy-MM-dd_HH:mm:ss.fff"));
     GlobalDiagnosticsContext.Set("stage", "StartUp");
     Log = LogManager.GetCurrentClassLogger();
   }
   
   public class Options {
 
-    [Option('i', "input", Required = true, HelpText = "Dafny file with the synthesis problem.")]
+    [Option('i', "input", Required = false, HelpText = "Dafny file with the synthesis problem.")]
     public string InputFile { get; set; } = "";
     
     [Option('g', "goal", Required = false, HelpText = "Name of the synthesis goal (if multiple synthesis annotated predicates exist).")]
@@ -57,6 +58,12 @@ public abstract class Driver {
       Default = null,
       HelpText = "Load pretrained data from directory")]
     public string? LoadHeuristics { get; set; }
+
+    [Option(
+      "ilpMemo",
+      Default = false,
+      HelpText = "Load the lower bounds memoized by earlier runs from the directory given by --loadPretrained and save them back at the end")]
+    public bool IlpMemo { get; set; }
     
     [Option(
       "greedy",
@@ -64,12 +71,139 @@ public abstract class Driver {
       HelpText = "Use the greedy distance metric")]
     public bool SUSHI { get; set; }
 
+    [Option(
+      "server",
+      Default = false,
+      HelpText = "Keep running and read synthesis jobs from standard input, one JSON object per line")]
+    public bool Server { get; set; }
+
+    [Option(
+      "telemetry",
+      Required = false,
+      Default = null,
+      HelpText = "Write machine-readable events (queries, expansions, heuristic values, solutions) to a JSON lines file in the specified directory")]
+    public string? TelemetryDir { get; set; }
+
+    [Option(
+      "queryCache",
+      Required = false,
+      Default = null,
+      HelpText = "Reuse the results of Dafny queries stored in the specified directory and store new ones there")]
+    public string? QueryCacheDir { get; set; }
+
+    [Option(
+      "seed",
+      Required = false,
+      Default = null,
+      HelpText = "File with a solution to a smaller problem (as printed by Metamorph) whose method calls the search should try to reuse")]
+    public string? Seed { get; set; }
+
+    [Option(
+      "portfolio",
+      Default = false,
+      HelpText = "Run the piecewise (with --loadPretrained if given), greedy, and no distance metric configurations in parallel and report the first solution found")]
+    public bool Portfolio { get; set; }
+
+    [Option(
+      "portfolioStrategy",
+      Required = false,
+      Default = null,
+      Hidden = true,
+      HelpText = "Name of the strategy this run implements in a portfolio (set by --portfolio)")]
+    public string? PortfolioStrategy { get; set; }
+
+    [Option(
+      "jobs",
+      Default = 1,
+      HelpText = "Number of Dafny queries to run at the same time while pretraining and while expanding a search node")]
+    public int Jobs { get; set; }
+
     public DateTime StartTime = DateTime.Now;
     public string? HeursticDir = null;
   }
 
+  /// <summary>
+  /// A synthesis job sent to a server, e.g. {"id": 0, "args": ["--input", "Problem00.dfy", "--greedy"]}.
+  /// The arguments are the same as those accepted on the command line.
+  /// </summary>
+  public record ServerJob(int Id, string[] Args);
+
+  /// <summary>
+  /// The server's reply to a job: the exit code and the standard output the job would have
+  /// produced had it been run on its own, and its running time in seconds
+  /// </summary>
+  public record ServerResponse(int Id, int ExitCode, double RunningTime, string Output);
+
+  private static readonly JsonSerializerOptions ServerJsonOptions = new() {
+    PropertyNamingPolicy = JsonNamingPolicy.CamelCase,
+    PropertyNameCaseInsensitive = true
+  };
+
   private static async Task Main(string[] args) {
-    await Parser.Default.ParseArguments<Options>(args).WithParsedAsync(ProcessOptionsAsync);
+    var exitCode = 0;
+    await Parser.Default.ParseArguments<Options>(args).WithParsedAsync(async options => {
+      exitCode = options.Server ? await ServeAsync() : await ProcessOptionsAsync(options);
+    });
+    if (exitCode != 0) {
+      Environment.Exit(exitCode);
+    }
+  }
+
+  /// <summary>
+  /// Process synthesis jobs one at a time until the standard input is closed.
+  /// Keeping the process alive saves JIT compilation and assembly loading on every job,
+  /// but all static state has to be reset in between jobs.
+  /// </summary>
+  private static async Task<int> ServeAsync() {
+    var serverOutput = Console.Out;
+    string? line;
+    while ((line = await Console.In.ReadLineAsync()) != null) {
+      if (string.IsNullOrWhiteSpace(line)) {
+        continue;
+      }
+      var job = JsonSerializer.Deserialize<ServerJob>(line, ServerJsonOptions);
+      if (job == null) {
+        continue;
+      }
+      var jobOutput = new StringWriter();
+      var exitCode = 1;
+      var startTime = DateTime.Now;
+      Console.SetOut(jobOutput);
+      try {
+        ResetState();
+        var parser = new Parser(settings => settings.HelpWriter = jobOutput);
+        await parser.ParseArguments<Options>(job.Args).WithParsedAsync(async options => {
+          if (options.Server) {
+            await Console.Error.WriteLineAsync("A server job cannot start another server");
+            return;
+          }
+          exitCode = await ProcessOptionsAsync(options);
+        });
+      } catch (Exception exception) {
+        Log.Error($"Job {job.Id} failed with an exception: {exception}");
+        await jobOutput.WriteLineAsync(exception.ToString());
+      } finally {
+        Console.SetOut(serverOutput);
+      }
+      var response = new ServerResponse(job.Id, exitCode, (DateTime.Now - startTime).TotalSeconds, jobOutput.ToString());
+      await serverOutput.WriteLineAsync(JsonSerializer.Serialize(response, ServerJsonOptions));
+      await serverOutput.FlushAsync();
+    }
+    return 0;
+  }
+
+  /// <summary>
+  /// Reset all static state so that a job run by the server behaves as if it was run in a fresh process
+  /// </summary>
+  private static void ResetState() {
+    GlobalDiagnosticsContext.Set("startTime", DateTime.Now.ToString("yyyy-MM-dd_HH:mm:ss.fff"));
+    GlobalDiagnosticsContext.Set("stage", "StartUp");
+    Heuristic.Clear();
+    State.Clear();
+    Property.Clear();
+    DafnyQuery.Clear();
+    Telemetry.Close();
+    QueryCache.Close();
   }
 
   private static Program? GetResolvedProgram(string inputFile, out string errorMessage) {
@@ -114,49 +248,82 @@ public abstract class Driver {
     return true;
   }
 
-  private static async Task ProcessOptionsAsync(Options options) {
+  private static async Task<int> ProcessOptionsAsync(Options options) {
 
     if (   (options.PreTrain != null       && (options.LoadHeuristics != null || options.DisableHeuristic || options.SUSHI))
         || (options.LoadHeuristics != null && (options.PreTrain != null       || options.DisableHeuristic || options.SUSHI))
         || (options.DisableHeuristic     && (options.LoadHeuristics != null   || options.PreTrain != null || options.SUSHI))
         || (options.SUSHI                && (options.LoadHeuristics != null   || options.PreTrain != null || options.DisableHeuristic))) {
       Log.Fatal("loadHeuristic, pretrain, disableHeuristic, and SUSHI and mutually exclusive options");
-      Environment.Exit(1);
+      return 1;
+    }
+
+    if (options.Portfolio && (options.PreTrain != null || options.DisableHeuristic || options.SUSHI)) {
+      Log.Fatal("portfolio runs its own configurations and cannot be combined with pretrain, noDistanceMetric, or greedy");
+      return 1;
     }
 
     options.HeursticDir = options.PreTrain ?? options.LoadHeuristics;
 
     if (options.HeursticDir != null && !Directory.Exists(Path.GetDirectoryName(options.HeursticDir))) {
       Log.Fatal($"Cannot find parent directory {Path.GetDirectoryName(options.HeursticDir)}");
-      Environment.Exit(1);
+      return 1;
     }
     
     if (options.HeursticDir != null && !Directory.Exists(options.HeursticDir)) {
       Directory.CreateDirectory(options.HeursticDir);
     }
     
+    if (options.Seed != null && !File.Exists(options.Seed)) {
+      Log.Fatal($"Cannot find seed file {options.Seed}");
+      return 1;
+    }
+
     if (!IsValidInputFile(options, out var errorMessage)) {
       await Console.Error.WriteLineAsync(errorMessage);
-      Environment.Exit(1);
+      return 1;
     }
     
     var success = true;
     
     GlobalDiagnosticsContext.Set("stage", new Regex("[/\\\\]").Replace(options.InputFile, "$"));
+    if (options.PortfolioStrategy != null) {
+      // the runs in a portfolio start at the same time, so their logs are told apart by strategy
+      GlobalDiagnosticsContext.Set("startTime", $"{GlobalDiagnosticsContext.Get("startTime")}-{options.PortfolioStrategy}");
+    }
+    if (options.Portfolio) {
+      return await Portfolio.RunAsync(options);
+    }
     options.StartTime = DateTime.Now;
     var resolvedProgram = GetResolvedProgram(options.InputFile, out var errorMessage2);
     if (resolvedProgram == null) {
       await Console.Error.WriteLineAsync(errorMessage2);
-      Environment.Exit(1);
+      return 1;
     }
-    if (options.PreTrain != null) {
-      await HeuristicLearner.LearnHeuristicsAsync(options, resolvedProgram, options.InputFile);
-      return;
+    if (options.QueryCacheDir != null) {
+      QueryCache.Open(options.QueryCacheDir);
     }
-    var result = await Search.SynthesizeAsync(options);
-    success = success && result.Outcome == Search.Outcome.Success;
-    if (!success) {
-      Environment.Exit(1);
+    try {
+      if (options.PreTrain != null) {
+        await HeuristicLearner.LearnHeuristicsAsync(options, resolvedProgram, options.InputFile);
+        return 0;
+      }
+      if (options.TelemetryDir != null) {
+        Telemetry.Open(options.TelemetryDir);
+        Telemetry.Emit("start", new { Input = options.InputFile, options.TimeLimit, Strategy = options.PortfolioStrategy });
+      }
+      var result = await Search.SynthesizeAsync(options);
+      if (options.IlpMemo) {
+        Heuristic.SaveIlpMemos(options);
+      }
+      success = success && result.Outcome == Search.Outcome.Success;
+    } finally {
+      if (QueryCache.IsEnabled) {
+        Log.Info($"Query cache: {QueryCache.Hits} hits and {QueryCache.Misses} misses");
+      }
+      Telemetry.Close();
+      QueryCache.Close();
     }
+    return success ? 0 : 1;
   }
 }
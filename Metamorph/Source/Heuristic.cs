@@ -31,10 +31,26 @@ public class Heuristic {
   private Dictionary<Property, HashSet<Property>> propertiesToIndex = new(); 
   // maps parent properties to all concrete properties of this type that have not been indexed yet
 
+  // the kinds of properties whose interactions were reused from a previous pretraining run (see Reuse), with which the
+  // methods that changed since still have to be checked
+  private readonly HashSet<Property> reusedProperties = new();
+
   private Property? currentPropertyUnderAnalysis = null;
 
+  private readonly IlpMemo ilpMemo = new();
+
   private const uint QueryTimeLimit = 40;
     
+  // The transitions between property values for which the heuristic estimates how many properties a method can flip
+  private static readonly (PropertyValue from, PropertyValue to)[] Transitions = {
+    (PropertyValue.False, PropertyValue.True),
+    (PropertyValue.True, PropertyValue.False),
+    (PropertyValue.Undefined, PropertyValue.True),
+    (PropertyValue.Undefined, PropertyValue.False),
+    (PropertyValue.False, PropertyValue.Undefined),
+    (PropertyValue.True, PropertyValue.Undefined)
+  };
+    
   private enum PropertyValue {
     True,
     False,
@@ -63,6 +79,7 @@ public class Heuristic {
 
   public static void Clear() {
     ClassNameToHeuristic.Clear();
+    IlpMemo.Reset();
   }
 
   private Heuristic(Driver.Options options, ClassDecl classDecl) {
@@ -162,6 +179,31 @@ public class Heuristic {
       return result;
     }
 
+    var memoKey = IlpMemoKey(relevantProperties);
+    if (ilpMemo.TryGet(memoKey, out var memoized)) {
+      Driver.Log.Debug($"Reusing the lower bound of {memoized} methods given by integer programming with the same constraints.");
+      return memoized;
+    }
+    var solvingBegan = DateTime.Now;
+    var bound = Solve(relevantProperties);
+    ilpMemo.Store(memoKey, bound, DateTime.Now - solvingBegan);
+    return bound;
+  }
+
+  /// <summary>
+  /// Describe every constraint of the integer programming problem by the number of properties of a kind that have
+  /// to change and by how many of them every method can change, leaving out which properties these are
+  /// </summary>
+  private string IlpMemoKey(Dictionary<Property, (int FToT, int TToF, int NToT, int NToF, int NTToT, int NFtoF)> relevantProperties) {
+    var constraints = relevantProperties.Select(pair => {
+      var effects = methods.Select(method => string.Join(",", Transitions.Select(transition =>
+        queryResults.TryGetValue(Tuple.Create(pair.Key, transition.from, transition.to, method), out var count) ? count : -1)));
+      return $"{pair.Value}:{string.Join(";", effects)}";
+    });
+    return IlpMemo.Key(methods.Select(method => method.Name), constraints);
+  }
+
+  private int Solve(Dictionary<Property, (int FToT, int TToF, int NToT, int NToF, int NTToT, int NFtoF)> relevantProperties) {
     var solver = Solver.CreateSolver("SCIP");
     var vars = new Dictionary<Method, Variable> {
       [methods[0]] = solver.MakeIntVar(0.0, double.PositiveInfinity, methods[0].Name)
@@ -343,10 +385,29 @@ public class Heuristic {
       var classDeclaration = VerificationUtils.FindClass(className, resolvedProgram);
       if (classDeclaration != null) {
         ClassNameToHeuristic[className] = Load(fileName, options, classDeclaration);
+        if (options.IlpMemo) {
+          ClassNameToHeuristic[className].ilpMemo.Load(IlpMemoFile(options, className));
+        }
       }
     }
   }
 
+  /// <summary>
+  /// Save the lower bounds memoized for every class next to the pretrained data, so that later runs reuse them
+  /// </summary>
+  public static void SaveIlpMemos(Synthesis.Driver.Options options) {
+    if (options.HeursticDir == null) {
+      return;
+    }
+    foreach (var className in ClassNameToHeuristic.Keys) {
+      ClassNameToHeuristic[className].ilpMemo.Save(IlpMemoFile(options, className));
+    }
+  }
+
+  private static string IlpMemoFile(Synthesis.Driver.Options options, string className) {
+    return Path.Combine(options.HeursticDir!, $"{className}{IlpMemo.Extension}");
+  }
+
   private void Save(string fileName, Program resolvedProgram) {
     using StreamWriter writer = new StreamWriter(fileName);
     var id = 0;
@@ -396,8 +457,13 @@ public class Heuristic {
           var from = GetPropertyValue(signatureParts[3]);
           var to = GetPropertyValue(signatureParts[4]);
           var propertyToChange = Property.GetProperty(type, converter.CloneExpr(((signature.Body.Body.First() as AssumeStmt)!).Expr));
+          var method = heuristic.methods.FirstOrDefault(method => method.Name == methodCall);
+          if (method == null) {
+            Driver.Log.Debug($"Ignoring pretrained facts about {methodCall}, which is no longer annotated with {{:use}}");
+            break;
+          }
           heuristic.queryResults[new Tuple<Property, PropertyValue, PropertyValue, Method>
-            (propertyToChange.Parent, from, to, heuristic.Methods.First(method => method.Name == methodCall))] = count;
+            (propertyToChange.Parent, from, to, method)] = count;
           break;
         case "AtStart":
           var value = GetPropertyValue(signatureParts[1]);
@@ -416,6 +482,49 @@ public class Heuristic {
     return heuristic;
   }
 
+  /// <summary>
+  /// Reuse the facts saved to <param name="fileName"></param> by a previous pretraining run: the values of properties
+  /// at the start and the interactions of properties with the methods in <param name="unchangedMethods"></param>
+  /// </summary>
+  public void Reuse(string fileName, ISet<string> unchangedMethods) {
+    var previous = Load(fileName, options, (ClassDecl)constructor.EnclosingClass);
+    foreach (var (property, value) in previous.valueAtStart) {
+      valueAtStart.TryAdd(property, value);
+    }
+    var reused = 0;
+    foreach (var ((property, from, to, previousMethod), count) in previous.queryResults) {
+      reusedProperties.Add(property);
+      var method = methods.FirstOrDefault(method => method.Name == previousMethod.Name);
+      if (method != null && unchangedMethods.Contains(method.Name) &&
+          queryResults.TryAdd(Tuple.Create(property, from, to, method), count)) {
+        reused++;
+      }
+    }
+    Driver.Log.Info($"Reusing {reused} pretrained interactions and {previous.valueAtStart.Count} start values for {type}");
+  }
+
+  /// <summary>
+  /// Estimate how every method interacts with every kind of property found so far, running up to
+  /// <param name="jobs"></param> Dafny queries at the same time. Interactions that are already known are skipped.
+  /// This includes the kinds of properties reused from a previous pretraining run.
+  /// </summary>
+  public async Task LearnInteractionsAsync(int jobs) {
+    if (options.DisableHeuristic || options.SUSHI) {
+      return;
+    }
+    var tasks = new List<Func<Task>>();
+    foreach (var property in propertiesToIndex.Keys.Union(reusedProperties)) {
+      var propertyFlipCap = property.Assignments.Count == 0 ? 1 : AffectedPropertiesCap;
+      foreach (var method in methods) {
+        foreach (var (from, to) in Transitions) {
+          tasks.Add(() => UpdateQueriesMapWithOnePropertyAsync(property, method, from, to, propertyFlipCap));
+        }
+      }
+    }
+    Driver.Log.Info($"Learning up to {tasks.Count} interactions between methods and properties of {type} with {jobs} job(s)");
+    await VerificationUtils.RunConcurrentlyAsync(tasks, jobs);
+  }
+
   /// <summary>
   /// Return true if the heuristic has been improved and we should reevaluate existing states
   /// </summary>
@@ -561,18 +670,10 @@ public class Heuristic {
     foreach (var property in properties.ConvertAll(property => property.Parent)) {
       foreach (var method in methods) {
         var propertyFlipCap = property.Assignments.Count == 0 ? 1 : AffectedPropertiesCap;
-        dafnyQueryMade = await UpdateQueriesMapWithOnePropertyAsync(property, method, PropertyValue.False, PropertyValue.True,
-          propertyFlipCap) || dafnyQueryMade;
-        dafnyQueryMade = await UpdateQueriesMapWithOnePropertyAsync(property, method, PropertyValue.True, PropertyValue.False,
-          propertyFlipCap) || dafnyQueryMade;
-        dafnyQueryMade = await UpdateQueriesMapWithOnePropertyAsync(property, method, PropertyValue.Undefined,
-          PropertyValue.True, propertyFlipCap) || dafnyQueryMade;
-        dafnyQueryMade =  await UpdateQueriesMapWithOnePropertyAsync(property, method, PropertyValue.Undefined,
-          PropertyValue.False, propertyFlipCap) || dafnyQueryMade;
-        dafnyQueryMade = await UpdateQueriesMapWithOnePropertyAsync(property, method, PropertyValue.False,
-          PropertyValue.Undefined, propertyFlipCap) || dafnyQueryMade;
-        dafnyQueryMade = await UpdateQueriesMapWithOnePropertyAsync(property, method, PropertyValue.True,
-          PropertyValue.Undefined, propertyFlipCap) || dafnyQueryMade;
+        foreach (var (from, to) in Transitions) {
+          dafnyQueryMade = await UpdateQueriesMapWithOnePropertyAsync(property, method, from, to,
+            propertyFlipCap) || dafnyQueryMade;
+        }
         if (dafnyQueryMade && returnAfterFirstDafnyQuery) {
           return dafnyQueryMade;
         }
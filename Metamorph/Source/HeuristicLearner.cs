@@ -1,4 +1,5 @@
 using System.Collections.Concurrent;
+using System.Text.Json;
 using Microsoft.Dafny;
 using Type = Microsoft.Dafny.Type;
 
@@ -8,8 +9,13 @@ namespace Synthesis;
 /// This class separates the heuristic learning stage from the rest of the algorithm.
 /// It performs forward synthesis starting from an arbitrary state,
 /// explores possible states by applying methods, improves the heuristic, and saves it to a file.
+/// Next to the file, it saves a fingerprint of every {:use} method and of the rest of the program, so that pretraining
+/// again after editing some of the methods only needs to learn how the edited methods interact with properties.
 /// </summary>
 public class HeuristicLearner {
+
+  private const string FingerprintsExtension = ".fingerprints.json";
+  private const string ContextFingerprint = ""; // the key for the fingerprint of everything but the {:use} methods
   
   public static async Task LearnHeuristicsAsync(Driver.Options options, Program resolvedProgram, string filename) {
     Search.SourceFile = new FileInfo(filename).FullName;
@@ -21,8 +27,10 @@ public class HeuristicLearner {
       return;
     }
     Driver.Log.Info($"Starting heuristic learning for classes: {string.Join(", ", classes.Select(c => c.FullDafnyName))}");
-    var tasks = classes.Select(classDecl => LearnHeuristicForClassAsync(options, classDecl, resolvedProgram));
-    await Task.WhenAll(tasks);
+    // classes are processed one at a time, queries about the same class can run in parallel (see --jobs)
+    foreach (var classDecl in classes) {
+      await LearnHeuristicForClassAsync(options, classDecl, resolvedProgram);
+    }
   }
 
   private static IEnumerable<ClassDecl> GetClassesWithUseMethods(Program resolvedProgram) {
@@ -45,11 +53,76 @@ public class HeuristicLearner {
     var heuristic = Heuristic.Get(options, classDecl);
     var targetType = new UserDefinedType(Token.NoToken, classDecl.FullDafnyName, new List<Type>());
     var initialState = new State(targetType, "");
-    await PerformForwardExplorationAsync(options, classDecl, initialState, heuristic, resolvedProgram);
+    var fingerprints = Fingerprints(classDecl);
+    var unchangedMethods = UnchangedMethods(options, classDecl, fingerprints);
+    await PerformForwardExplorationAsync(options, classDecl, initialState, heuristic, resolvedProgram, unchangedMethods);
     Heuristic.SaveAll(options, resolvedProgram);
+    File.WriteAllText(FingerprintsFile(options, classDecl), JsonSerializer.Serialize(fingerprints));
+  }
+
+  /// <summary>
+  /// Fingerprints of the {:use} methods of a class (keyed by name) and of the rest of the program
+  /// </summary>
+  private static Dictionary<string, string> Fingerprints(ClassDecl classDecl) {
+    var unresolvedClass = VerificationUtils.FindClass(classDecl.FullDafnyName, VerificationUtils.UnresolvedProgram)!;
+    var methods = Search.FindMemberDeclsWithAttributes(unresolvedClass, "use").OfType<Method>().ToList();
+    var fingerprints = new Dictionary<string, string> {
+      [ContextFingerprint] = VerificationUtils.ProgramDigest(VerificationUtils.UnresolvedProgram, Search.SourceFile,
+        methods.Select(method => ((TopLevelDeclWithMembers)unresolvedClass, (MemberDecl)method)).ToList())
+    };
+    foreach (var method in methods) {
+      using var writer = new StringWriter();
+      new Printer(writer, DafnyOptions.Default).PrintMethod(method, 0, false);
+      fingerprints[method.Name] = VerificationUtils.Digest(writer.ToString());
+    }
+    return fingerprints;
   }
 
-  private static async Task PerformForwardExplorationAsync(Driver.Options options, ClassDecl classDecl, State initialState, Heuristic heuristic, Program resolvedProgram) {
+  /// <summary>
+  /// The methods whose fingerprints match those saved by the previous pretraining run, or null if there is nothing to
+  /// reuse because the rest of the program has changed since then
+  /// </summary>
+  private static HashSet<string>? UnchangedMethods(Driver.Options options, ClassDecl classDecl, Dictionary<string, string> fingerprints) {
+    var fingerprintsFile = FingerprintsFile(options, classDecl);
+    if (!File.Exists(fingerprintsFile) || !File.Exists(HeuristicFile(options, classDecl))) {
+      return null;
+    }
+    Dictionary<string, string>? previous = null;
+    try {
+      previous = JsonSerializer.Deserialize<Dictionary<string, string>>(File.ReadAllText(fingerprintsFile));
+    } catch (JsonException exception) {
+      Driver.Log.Warn($"Could not read {fingerprintsFile}: {exception.Message}");
+    }
+    if (previous == null || previous.GetValueOrDefault(ContextFingerprint) != fingerprints[ContextFingerprint]) {
+      Driver.Log.Info($"Pretraining {classDecl.FullDafnyName} from scratch");
+      return null;
+    }
+    var unchangedMethods = new HashSet<string>();
+    foreach (var (name, fingerprint) in fingerprints) {
+      if (name != ContextFingerprint && previous.GetValueOrDefault(name) == fingerprint) {
+        unchangedMethods.Add(name);
+      }
+    }
+    Driver.Log.Info($"Methods changed since the last pretraining: " +
+                    $"{string.Join(", ", fingerprints.Keys.Where(name => name != ContextFingerprint && !unchangedMethods.Contains(name)))}");
+    return unchangedMethods;
+  }
+
+  private static string HeuristicFile(Driver.Options options, ClassDecl classDecl) {
+    return Path.Combine(options.HeursticDir!, $"{classDecl.FullDafnyName}.dfy");
+  }
+
+  private static string FingerprintsFile(Driver.Options options, ClassDecl classDecl) {
+    return Path.Combine(options.HeursticDir!, $"{classDecl.FullDafnyName}{FingerprintsExtension}");
+  }
+
+  private static async Task PerformForwardExplorationAsync(Driver.Options options, ClassDecl classDecl, State initialState, Heuristic heuristic, Program resolvedProgram, HashSet<string>? unchangedMethods) {
+    // The reused facts already cover the properties that exploring the unchanged methods led to in the previous run, so
+    // only the methods added or changed since are explored again. The properties these lead to are learned for all
+    // methods, and the reused kinds of properties for them (see Heuristic.LearnInteractionsAsync).
+    if (unchangedMethods != null) {
+      heuristic.Reuse(HeuristicFile(options, classDecl), unchangedMethods);
+    }
     // Initialize the fringe for BFS
     var fringe = new Queue<(State state, int depth)>();
     var explored = new ConcurrentDictionary<State, bool>();
@@ -62,14 +135,20 @@ public class HeuristicLearner {
         continue;
       }
       // For each method, apply it to the state
-      foreach (var method in heuristic.Methods) {
+      var methods = heuristic.Methods
+        .Where(method => currentDepth != 0 || unchangedMethods?.Contains(method.Name) != true).ToList();
+      var newStates = new State?[methods.Count];
+      await VerificationUtils.RunConcurrentlyAsync(methods.Select((method, i) => (Func<Task>)(async () => {
         // Construct a DafnyQuery to simulate applying the method
         Driver.Log.Info($"Trying out {method.Name}");
         var query = new DafnyQuery(classDecl.FullDafnyName, classDecl.FullDafnyName,new List<Method> { method }, state, new State(state.Type, ""), null, null, null);
         // Try to infer method arguments and resulting state
         var result = await query.InferMethodArgumentsAndObjectStateAsync(VerificationUtils.QueryType.Regular, Search.DefaultTimeLimit, true);
-        if (result.state != null) {
-          var newState = result.state;
+        newStates[i] = result.state;
+      })), options.Jobs);
+      // process the results in the order of the methods, so that the outcome does not depend on the number of jobs
+      foreach (var newState in newStates) {
+        if (newState != null) {
           // Update heuristic with new properties from newState
           await heuristic.UpdateHeuristicWithNewPropertiesAsync(newState.Keys.Select(k => k.Property).ToList());
           // If newState is not already explored, add it to fringe
@@ -80,6 +159,8 @@ public class HeuristicLearner {
         }
       }
     }
+    // Interactions between methods and properties are independent of each other, so learn them in parallel first
+    await heuristic.LearnInteractionsAsync(options.Jobs);
     // After exploration, try to improve the heuristic
     bool heuristicImproved = true;
     while (heuristicImproved) {
@@ -0,0 +1,98 @@
+using System.Text.Json;
+
+namespace Synthesis;
+
+/// <summary>
+/// A bounded memo of the lower bounds computed by integer programming for the heuristic of one class. The same
+/// integer programs come up again and again, both for different states of the same search and for different
+/// problems about the same class, since an integer program only depends on how many properties of each kind have to
+/// change and on how every method can change them, not on which properties these are. Entries are evicted in least
+/// recently used order, and the memo can be saved next to the pretrained data (see --ilpMemo).
+/// </summary>
+public class IlpMemo {
+
+  private const int Capacity = 4096;
+  public const string Extension = ".ilp.json";
+
+  public static int Hits { get; private set; }
+  public static int Misses { get; private set; }
+  public static TimeSpan SolvingTime { get; private set; }
+
+  // most recently used entries are at the end of the list
+  private readonly LinkedList<(string key, int bound)> order = new();
+  private readonly Dictionary<string, LinkedListNode<(string key, int bound)>> entries = new();
+
+  public static void Reset() {
+    Hits = 0;
+    Misses = 0;
+    SolvingTime = TimeSpan.Zero;
+  }
+
+  /// <summary>
+  /// The key of an integer program, given the description of every constraint in it. The order of the constraints
+  /// does not matter.
+  /// </summary>
+  public static string Key(IEnumerable<string> methodNames, IEnumerable<string> constraints) {
+    return VerificationUtils.Digest(constraints.OrderBy(constraint => constraint, StringComparer.Ordinal)
+      .Prepend(string.Join(",", methodNames)).ToArray());
+  }
+
+  public bool TryGet(string key, out int bound) {
+    if (!entries.TryGetValue(key, out var node)) {
+      bound = 0;
+      Misses++;
+      return false;
+    }
+    order.Remove(node);
+    order.AddLast(node);
+    bound = node.Value.bound;
+    Hits++;
+    return true;
+  }
+
+  public void Store(string key, int bound, TimeSpan solvingTime) {
+    SolvingTime += solvingTime;
+    Add(key, bound);
+  }
+
+  private void Add(string key, int bound) {
+    if (entries.TryGetValue(key, out var node)) {
+      order.Remove(node);
+    }
+    entries[key] = order.AddLast((key, bound));
+    if (entries.Count > Capacity) {
+      entries.Remove(order.First!.Value.key);
+      order.RemoveFirst();
+    }
+  }
+
+  public void Load(string fileName) {
+    if (!File.Exists(fileName)) {
+      return;
+    }
+    try {
+      // entries are saved from the least to the most recently used one
+      var saved = JsonSerializer.Deserialize<List<KeyValuePair<string, int>>>(File.ReadAllText(fileName));
+      foreach (var (key, bound) in saved ?? new()) {
+        Add(key, bound);
+      }
+      Driver.Log.Info($"Loaded {entries.Count} memoized integer programming estimates from {fileName}");
+    } catch (Exception exception) when (exception is IOException or JsonException) {
+      Driver.Log.Warn($"Could not read memoized integer programming estimates: {exception.Message}");
+    }
+  }
+
+  public void Save(string fileName) {
+    // write to a temporary file first, so that concurrent runs never see a partially written memo
+    var temporaryPath = $"{fileName}.{Environment.ProcessId}.{Guid.NewGuid():N}.tmp";
+    try {
+      var saved = order.Select(entry => new KeyValuePair<string, int>(entry.key, entry.bound)).ToList();
+      File.WriteAllText(temporaryPath, JsonSerializer.Serialize(saved));
+      File.Move(temporaryPath, fileName, true);
+    } catch (IOException exception) {
+      Driver.Log.Warn($"Could not save memoized integer programming estimates: {exception.Message}");
+      File.Delete(temporaryPath);
+    }
+  }
+
+}
@@ -0,0 +1,126 @@
+using System.Diagnostics;
+
+namespace Synthesis;
+
+/// <summary>
+/// Runs several configurations of Metamorph on the same synthesis problem at the same time, each in a process of its
+/// own, and reports the solution of whichever finds one first. The other processes are killed as soon as a solution
+/// is found, so the running time is the minimum over the configurations (plus the startup of the processes).
+/// </summary>
+public abstract class Portfolio {
+
+  /// <summary>
+  /// A configuration of Metamorph that takes part in a portfolio, given by its extra command line arguments
+  /// </summary>
+  public record Strategy(string Name, string[] Args);
+
+  private record Run(Strategy Strategy, int ExitCode, string Output, TimeSpan RunningTime);
+
+  public static List<Strategy> Strategies(Driver.Options options) {
+    return new List<Strategy> {
+      new("piecewise", options.LoadHeuristics != null ? new[] { "--loadPretrained", options.LoadHeuristics } : Array.Empty<string>()),
+      new("greedy", new[] { "--greedy" }),
+      new("noDistanceMetric", new[] { "--noDistanceMetric" })
+    };
+  }
+
+  /// <summary>
+  /// Race all strategies on the problem described by <param name="options"></param>, print the output of the first
+  /// one to succeed (or of the last one to finish if none succeeds), and return the corresponding exit code
+  /// </summary>
+  public static async Task<int> RunAsync(Driver.Options options) {
+    var began = DateTime.Now;
+    var processes = new List<Process>();
+    var pending = new List<Task<Run>>();
+    Run? last = null;
+    try {
+      foreach (var strategy in Strategies(options)) {
+        var process = Start(options, strategy);
+        processes.Add(process);
+        pending.Add(WaitAsync(strategy, process, began));
+        Driver.Log.Info($"Started strategy {strategy.Name} (process {process.Id})");
+      }
+      while (pending.Count != 0) {
+        var finished = await Task.WhenAny(pending);
+        pending.Remove(finished);
+        last = await finished;
+        Driver.Log.Info($"Strategy {last.Strategy.Name} finished with exit code {last.ExitCode} after {last.RunningTime}");
+        if (last.ExitCode == 0) {
+          Driver.Log.Info($"Strategy {last.Strategy.Name} won the portfolio");
+          break;
+        }
+      }
+    } finally {
+      Stop(processes, pending);
+    }
+    await Console.Out.WriteAsync(last?.Output ?? "");
+    return last?.ExitCode ?? 1;
+  }
+
+  private static Process Start(Driver.Options options, Strategy strategy) {
+    var processPath = Environment.ProcessPath!;
+    var startInfo = new ProcessStartInfo(processPath) {
+      RedirectStandardOutput = true,
+      UseShellExecute = false
+    };
+    // when run with `dotnet Metamorph.dll`, the process is the .NET host and has to be given the assembly
+    if (Path.GetFileNameWithoutExtension(processPath) == "dotnet") {
+      startInfo.ArgumentList.Add(typeof(Portfolio).Assembly.Location);
+    }
+    var args = new List<string> { "--input", options.InputFile, "--portfolioStrategy", strategy.Name };
+    if (options.MethodName != null) {
+      args.AddRange(new[] { "--goal", options.MethodName });
+    }
+    if (options.TimeLimit != int.MaxValue) {
+      args.AddRange(new[] { "--timeLimit", options.TimeLimit.ToString() });
+    }
+    if (options.TelemetryDir != null) {
+      args.AddRange(new[] { "--telemetry", options.TelemetryDir });
+    }
+    if (options.QueryCacheDir != null) {
+      args.AddRange(new[] { "--queryCache", options.QueryCacheDir });
+    }
+    if (options.Seed != null) {
+      args.AddRange(new[] { "--seed", options.Seed });
+    }
+    if (options.Jobs > 1) {
+      args.AddRange(new[] { "--jobs", options.Jobs.ToString() });
+    }
+    if (options.IlpMemo) {
+      args.Add("--ilpMemo");
+    }
+    foreach (var arg in args.Concat(strategy.Args)) {
+      startInfo.ArgumentList.Add(arg);
+    }
+    return Process.Start(startInfo)!;
+  }
+
+  private static async Task<Run> WaitAsync(Strategy strategy, Process process, DateTime began) {
+    var output = process.StandardOutput.ReadToEndAsync();
+    await process.WaitForExitAsync();
+    return new Run(strategy, process.ExitCode, await output, DateTime.Now - began);
+  }
+
+  /// <summary>
+  /// Kill the processes that are still running and wait for them to exit
+  /// </summary>
+  private static void Stop(List<Process> processes, List<Task<Run>> pending) {
+    foreach (var process in processes) {
+      try {
+        if (!process.HasExited) {
+          process.Kill(entireProcessTree: true);
+        }
+      } catch (InvalidOperationException) {
+        // the process exited in the meantime
+      }
+    }
+    try {
+      Task.WaitAll(pending.ToArray<Task>(), TimeSpan.FromSeconds(10));
+    } catch (AggregateException exception) {
+      Driver.Log.Warn($"A strategy could not be stopped cleanly: {exception.InnerException?.Message}");
+    }
+    foreach (var process in processes) {
+      process.Dispose();
+    }
+  }
+}
@@ -0,0 +1,141 @@
+using System.Text.Json;
+using System.Text.RegularExpressions;
+using Microsoft.Dafny;
+using Program = Microsoft.Dafny.Program;
+
+namespace Synthesis;
+
+/// <summary>
+/// A persistent, on-disk cache of the results of Dafny queries that can be shared between runs on different
+/// synthesis problems for the same API (e.g. all problems of a benchmark). Every result is stored in a file of its
+/// own, named after a hash of the query normalized as follows:
+/// - the program is represented by everything except the synthesis goals, which differ between problems but are
+///   never used by a query, and by the contents of all the files the input file includes;
+/// - the names of generated formals, which embed ids that depend on the order in which the search encounters
+///   properties and queries, are renamed in order of their first appearance in the query.
+/// Only definite results (verified or a counterexample) are cached, since a timeout depends on the load of the machine.
+/// </summary>
+public abstract class QueryCache {
+
+  private const string SynthesizeAttribute = "synthesize";
+  private static readonly Regex GeneratedNameRegex =
+    new($"({DafnyQuery.ArgumentNamePrefix}|{State.FormalNamePrefix})\\d+_\\d+");
+  private static readonly Regex CanonicalNameRegex =
+    new($"({DafnyQuery.ArgumentNamePrefix}|{State.FormalNamePrefix})c\\d+");
+  private static readonly string[] InconclusiveOutputs = { "timed out", "out of resource", "out of memory" };
+
+  private static string? directory;
+  private static string contextDigest = "";
+
+  public static int Hits { get; private set; }
+  public static int Misses { get; private set; }
+  public static bool IsEnabled => directory != null;
+
+  private record Entry(string Status, string Output);
+
+  /// <summary>
+  /// A query after normalization, together with the renaming needed to translate stored results back
+  /// </summary>
+  public class Key {
+    public readonly string Hash;
+    private readonly Dictionary<string, string> toCanonical = new();
+    private readonly Dictionary<string, string> fromCanonical = new();
+
+    public Key(string qualifiedClassName, string methodText, bool assumeAllPreconditions) {
+      var normalized = Normalize(methodText);
+      Hash = VerificationUtils.Digest(contextDigest, qualifiedClassName, assumeAllPreconditions.ToString(), normalized);
+    }
+
+    public string Normalize(string text) {
+      return GeneratedNameRegex.Replace(text, match => {
+        if (!toCanonical.TryGetValue(match.Value, out var canonical)) {
+          canonical = $"{match.Groups[1].Value}c{toCanonical.Count}";
+          toCanonical[match.Value] = canonical;
+          fromCanonical[canonical] = match.Value;
+        }
+        return canonical;
+      });
+    }
+
+    public string Denormalize(string text) {
+      return CanonicalNameRegex.Replace(text, match =>
+        fromCanonical.TryGetValue(match.Value, out var name) ? name : match.Value);
+    }
+  }
+
+  public static void Open(string cacheDirectory) {
+    Directory.CreateDirectory(cacheDirectory);
+    directory = cacheDirectory;
+    Hits = 0;
+    Misses = 0;
+  }
+
+  public static void Close() {
+    directory = null;
+    contextDigest = "";
+  }
+
+  /// <summary>
+  /// Compute the digest of everything a query depends on apart from the query itself
+  /// </summary>
+  public static void SetContext(Program unresolvedProgram, string sourceFile) {
+    contextDigest = VerificationUtils.ProgramDigest(unresolvedProgram, sourceFile, SynthesisGoals(unresolvedProgram.DefaultModuleDef).ToList());
+  }
+
+  public static bool TryGet(Key key, out VerificationResult.Status status, out string output) {
+    status = VerificationResult.Status.Timeout;
+    output = "";
+    Entry? entry = null;
+    try {
+      var path = PathFor(key);
+      if (File.Exists(path)) {
+        entry = JsonSerializer.Deserialize<Entry>(File.ReadAllText(path));
+      }
+    } catch (Exception exception) when (exception is IOException or JsonException) {
+      Driver.Log.Warn($"Could not read a cached query result: {exception.Message}");
+    }
+    if (entry == null || !Enum.TryParse(entry.Status, out status)) {
+      Misses++;
+      return false;
+    }
+    Hits++;
+    output = key.Denormalize(entry.Output);
+    return true;
+  }
+
+  public static void Store(Key key, VerificationResult.Status status, string output) {
+    if (status == VerificationResult.Status.Timeout || InconclusiveOutputs.Any(message => output.Contains(message))) {
+      return;
+    }
+    var path = PathFor(key);
+    // write to a temporary file first, so that concurrent runs never see a partially written result
+    var temporaryPath = $"{path}.{Environment.ProcessId}.{Guid.NewGuid():N}.tmp";
+    try {
+      File.WriteAllText(temporaryPath, JsonSerializer.Serialize(new Entry(status.ToString(), key.Normalize(output))));
+      File.Move(temporaryPath, path, true);
+    } catch (IOException exception) {
+      Driver.Log.Warn($"Could not cache a query result: {exception.Message}");
+      File.Delete(temporaryPath);
+    }
+  }
+
+  private static string PathFor(Key key) {
+    return Path.Combine(directory!, $"{key.Hash}.json");
+  }
+
+  private static IEnumerable<(TopLevelDeclWithMembers container, MemberDecl goal)> SynthesisGoals(ModuleDefinition module) {
+    foreach (var decl in module.TopLevelDecls) {
+      if (decl is LiteralModuleDecl moduleDecl) {
+        foreach (var goal in SynthesisGoals(moduleDecl.ModuleDef)) {
+          yield return goal;
+        }
+      }
+      if (decl is TopLevelDeclWithMembers withMembers) {
+        foreach (var goal in Search.FindMemberDeclsWithAttributes(withMembers, SynthesizeAttribute)) {
+          yield return (withMembers, goal);
+        }
+      }
+    }
+  }
+
+}
@@ -1,3 +1,4 @@
+using System.Text.RegularExpressions;
 using DafnyTestGeneration;
 using Microsoft.Dafny;
 using IdentifierExpr = Microsoft.Dafny.IdentifierExpr;
@@ -13,6 +14,9 @@ public abstract class Search {
   private const double HeuristicWeight = 2;
   public const uint DefaultTimeLimit = 150;
   private const uint SimplificationTimeLimit = 40;
+  // The number of states at each depth of the search for which the seed is tried (see SynthesizeHelperAsync)
+  private const int SeedTriesPerDepth = 4;
+  private static readonly Regex SeedCallRegex = new("\\bresult\\.(\\w+)\\(");
 
   private record SearchNode(List<Statement> Solution, List<Method> Methods, State State, int EstimatedDistanceToStartState, int DistanceToEndState) {
     public readonly List<Statement> Solution = Solution;
@@ -55,10 +59,12 @@ public abstract class Search {
     }
     var targetType = new UserDefinedType(Token.NoToken, targetClass!.FullDafnyName, new List<Type>());
     var endState = GetState(targetType, resolvedTarget!.Formals.First().Name, resolvedTarget.Body);
-    var result = await SynthesizeHelperAsync(options, targetClass, endState, "result", resolvedProgram);
+    var seed = options.Seed == null ? null : ReadSeed(options.Seed, Heuristic.Get(options, targetClass));
+    var result = await SynthesizeHelperAsync(options, targetClass, endState, "result", resolvedProgram, seed);
     if (result == null && DateTime.Now - options.StartTime > new TimeSpan(options.TimeLimit * TimeSpan.TicksPerSecond)) {
       Driver.Log.Warn($"Have reached the allotted time limit of {options.TimeLimit} seconds. Terminating the search for solution.");
       await Console.Out.WriteLineAsync($"Have reached the allotted time limit of {options.TimeLimit} seconds. Terminating the search for solution.");
+      EmitEnd(Outcome.Timeout, evaluationBegan);
       return new Result(Outcome.Timeout, DateTime.Now - options.StartTime);
     }
     if (result != null) {
@@ -69,26 +75,63 @@ public abstract class Search {
                        $"{string.Join("\n", result.ConvertAll(statement => Printer.StatementToString(DafnyOptions.Default, statement)))}\n" +
                        $"}}";
       Driver.Log.Info($"Have found the following solution!\n{methodBody}");
+      Telemetry.Emit("solution", new { Subproblem = false, Statements = result.Count });
       await Console.Out.WriteLineAsync($"{methodBody}");
-      Driver.Log.Info($"Total time spend on synthesis: {DateTime.Now - evaluationBegan}");
-      foreach (VerificationUtils.QueryType queryType in Enum.GetValues(typeof(VerificationUtils.QueryType))) {
-        Driver.Log.Info(
-          $"Total number of {queryType} queries to Dafny: {VerificationUtils.DafnyQueryCount[queryType]} ({VerificationUtils.DafnyQueryTime[queryType]})");
-      }
+      LogTotals(evaluationBegan);
+      EmitEnd(Outcome.Success, evaluationBegan);
       return new Result(Outcome.Success, DateTime.Now - options.StartTime);
     }
     
     Driver.Log.Info("Have enumerated all possible states and could not find a solution.");
+    LogTotals(evaluationBegan);
+    await Console.Out.WriteLineAsync("Failed to synthesized a solution.");
+    EmitEnd(Outcome.Fail, evaluationBegan);
+    return new Result(Outcome.Fail, DateTime.Now - options.StartTime);
+  }
+
+  private static void LogTotals(DateTime evaluationBegan) {
     Driver.Log.Info($"Total time spend on synthesis: {DateTime.Now - evaluationBegan}");
     foreach (VerificationUtils.QueryType queryType in Enum.GetValues(typeof(VerificationUtils.QueryType))) {
       Driver.Log.Info(
         $"Total number of {queryType} queries to Dafny: {VerificationUtils.DafnyQueryCount[queryType]} ({VerificationUtils.DafnyQueryTime[queryType]})");
     }
-    await Console.Out.WriteLineAsync("Failed to synthesized a solution.");
-    return new Result(Outcome.Fail, DateTime.Now - options.StartTime);
+    Driver.Log.Info(
+      $"Integer programming estimates: {IlpMemo.Hits} memoized and {IlpMemo.Misses} solved ({IlpMemo.SolvingTime})");
+  }
+
+  private static void EmitEnd(Outcome outcome, DateTime evaluationBegan) {
+    Telemetry.Emit("end", new {
+      Outcome = outcome.ToString(), Seconds = (DateTime.Now - evaluationBegan).TotalSeconds, Queries = Telemetry.QuerySummary()
+    });
+  }
+
+  /// <summary>
+  /// Read the sequence of methods called on the result in a previously synthesized solution (see --seed)
+  /// </summary>
+  private static List<Method>? ReadSeed(string seedFile, Heuristic heuristic) {
+    var seed = new List<Method>();
+    foreach (Match match in SeedCallRegex.Matches(File.ReadAllText(seedFile))) {
+      var method = heuristic.Methods.FirstOrDefault(method => method.Name == match.Groups[1].Value);
+      if (method == null) {
+        Driver.Log.Warn($"Ignoring the seed in {seedFile}, since {match.Groups[1].Value} is not annotated with {{:use}}");
+        return null;
+      }
+      seed.Add(method);
+    }
+    if (seed.Count == 0) {
+      Driver.Log.Warn($"Ignoring the seed in {seedFile}, which does not call any methods");
+      return null;
+    }
+    Driver.Log.Info($"Seeding the search with method sequence {string.Join(", ", seed.Select(method => method.Name))}");
+    return seed;
   }
 
-  private static async Task<List<Statement>?> SynthesizeHelperAsync(Driver.Options options, ClassDecl resolvedClassDeclaration, State endState, string receiverName, Program resolvedProgram) {
+  /// <summary>
+  /// Search backwards from the end state for a sequence of method calls that transforms a newly constructed object
+  /// into an object in the end state. If a <param name="seed"></param> is given, the search also checks whether
+  /// calling the seed methods (with any arguments) on a new object leads to some of the states being expanded.
+  /// </summary>
+  private static async Task<List<Statement>?> SynthesizeHelperAsync(Driver.Options options, ClassDecl resolvedClassDeclaration, State endState, string receiverName, Program resolvedProgram, List<Method>? seed = null) {
     var evaluationBegan = DateTime.Now;
     Dictionary<VerificationUtils.QueryType, int> priorDafnyQueryCount = new();
     Dictionary<VerificationUtils.QueryType, TimeSpan> priorDafnyQueryTime = new();
@@ -102,8 +145,10 @@ public abstract class Search {
     var targetType = new UserDefinedType(Token.NoToken, resolvedClassDeclaration.FullDafnyName, new List<Type>());
     var fringe = new PriorityQueue<SearchNode, double>();
     var explored = new HashSet<State>() {endState}; // States already explored
+    var seedTries = new Dictionary<int, int>(); // How often the seed has been tried at each distance to the end state
     var endStateEstimate = heuristic.EstimateDistanceFromStartState(endState);
     Driver.Log.Info($"Initial heuristic value is {endStateEstimate}");
+    Telemetry.Emit("heuristic", new { Sequence = Array.Empty<string>(), Value = endStateEstimate });
     fringe.Enqueue(new SearchNode(new List<Statement>(), new List<Method>(), endState, endStateEstimate, 0), endStateEstimate);
     List<Statement> solution = new List<Statement>();
     while (fringe.Count != 0) {
@@ -113,18 +158,41 @@ public abstract class Search {
       Driver.Log.Info($"Expanding method sequence {string.Join(", ", next.Methods.Select(method => method.Name))} -- " +
                $"estimated distance to start = {next.EstimatedDistanceToStartState}, " +
                $"distance to end = {next.DistanceToEndState}");
+      Telemetry.Emit("expand", new {
+        Sequence = next.Methods.Select(method => method.Name), Estimate = next.EstimatedDistanceToStartState, Depth = next.DistanceToEndState
+      });
+      // the methods to call on a newly constructed object to try and reach the state being expanded
+      var startSequences = new List<List<Method>>();
       if (next.EstimatedDistanceToStartState == 0) {
+        startSequences.Add(new List<Method>());
+      }
+      // likewise, the seed can only lead to states with an estimate of at most its length. Every such check is a full
+      // query, so the seed is only tried for the first SeedTriesPerDepth of these states expanded at each depth (the
+      // ones the heuristic considers closest to the start), and not for states estimated to be reachable by the
+      // constructor alone
+      var seedTriesAtDepth = seedTries.GetValueOrDefault(next.DistanceToEndState);
+      var triesSeed = seed != null && next.EstimatedDistanceToStartState > 0 &&
+                      next.EstimatedDistanceToStartState <= seed.Count && seedTriesAtDepth < SeedTriesPerDepth;
+      if (triesSeed) {
+        startSequences.Add(seed!);
+        seedTries[next.DistanceToEndState] = ++seedTriesAtDepth;
+      }
+      foreach (var startSequence in startSequences) {
         var constructor = resolvedClassDeclaration.Members.OfType<Constructor>().First();
         var query2 = new DafnyQuery(resolvedClassDeclaration.FullDafnyName, resolvedClassDeclaration.FullDafnyName,
-          new List<Method> { constructor }, new State(targetType, ""),
+          startSequence.Prepend(constructor), new State(targetType, ""),
           next.State);
         var constraints = await query2.InferMethodArgumentsAndObjectStateAsync(VerificationUtils.QueryType.Regular, DefaultTimeLimit, false);
         if (constraints.method != null) {
+          if (startSequence.Count != 0) {
+            Driver.Log.Info($"The seed leads to the state reached by method sequence {string.Join(", ", next.Methods.Select(method => method.Name))}");
+          }
           var updateStatements = new SolutionFormatter().Format(constraints.method.Body.Body, receiverName).Concat(next.Solution);
           var methodBody = $"{{\n" +
                            $"{string.Join("\n", updateStatements.Select(statement => Printer.StatementToString(DafnyOptions.Default, statement)))}\n" +
                            $"}}";
           Driver.Log.Info($"Have found the following solution to a subproblem!\n{methodBody}");
+          Telemetry.Emit("solution", new { Subproblem = true, Statements = updateStatements.Count() });
           Driver.Log.Info($"Time spend on subproblem: {DateTime.Now - evaluationBegan}");
           foreach (VerificationUtils.QueryType queryType in Enum.GetValues(typeof(VerificationUtils.QueryType))) {
             Driver.Log.Info(
@@ -134,8 +202,25 @@ public abstract class Search {
           break;
         }
       }
-      foreach (var method in heuristic.Methods) {
-        if (DateTime.Now - options.StartTime > new TimeSpan(options.TimeLimit * TimeSpan.TicksPerSecond)) {
+      if (solution.Any()) {
+        break;
+      }
+      if (triesSeed && seedTriesAtDepth == SeedTriesPerDepth) {
+        Driver.Log.Info($"Giving up on the seed at distance {next.DistanceToEndState} to the end state after {SeedTriesPerDepth} tries");
+      }
+      // the queries about the methods that may lead to the state being expanded are independent of each other, so up to
+      // --jobs of them run at the same time, but their results are processed in the order of the methods, so that the
+      // search does not depend on the number of jobs
+      var methods = heuristic.Methods.ToList();
+      var predecessors = new (State state, Method method)[methods.Count];
+      await VerificationUtils.RunConcurrentlyAsync(methods.Select((method, i) => (Func<Task>)(async () => {
+        if (!TimeLimitReached(options)) {
+          predecessors[i] = await FindPredecessorAsync(resolvedClassDeclaration, targetType, next, method);
+        }
+      })), options.Jobs);
+      for (var i = 0; i < methods.Count; i++) {
+        var method = methods[i];
+        if (TimeLimitReached(options)) {
           return null;
         }
 
@@ -154,57 +239,15 @@ public abstract class Search {
           }
         }
 
-        Driver.Log.Debug("Trying method sequence: " + string.Join(", ", next.Methods.Prepend(method).Select(method => method.Name)));
-        
-        
-        var query = new DafnyQuery(resolvedClassDeclaration.FullDafnyName, resolvedClassDeclaration.FullDafnyName,
-          new List<Method> { method }, next.State.Negate(),
-          next.State);
-        var negation = await query.InferMethodArgumentsAndObjectStateAsync(VerificationUtils.QueryType.Regular, DefaultTimeLimit, false);
-        var previous = negation.state;
+        var (previous, queryMethod) = predecessors[i];
         if (previous == null) {
           continue;
         }
 
-        // create a state defined only by the properties shared between next and previous:
-        var previousSimplified = new State(targetType, "");
-        foreach (var indexedProperty in previous.Keys.OrderBy(key => key.Index)) {
-          // TODO: there might be well-formedness issues arising here, need to double-check this is sound
-          var matchingProperty = next.State.Keys.FirstOrDefault(key => key.Property == indexedProperty.Property);
-          if (matchingProperty == null) {
-            continue;
-          }
-          if (next.State[matchingProperty] == previous[indexedProperty]) {
-            previousSimplified[indexedProperty] = previous[indexedProperty];
-          }
-        }
-
-        // Reuse the method synthesized above for transforming previous to next 
-        // and see if the same method transforms previousSimplified to next
-        List<AssumeStmt> argumentAssumptions = new List<AssumeStmt>();
-        List<Formal> argumentFormals = new List<Formal>();
-        if (method.Ins.Any()) {
-          var lastArgumentAssumption = negation.method.Body.Body.OfType<AssumeStmt>()
-            .Last(statement => statement.Attributes != null && statement.Attributes.Name == State.AssumptionDescribesArgumentAttribute);
-          var lastArgumentAssumptionIndex = negation.method.Body.Body.IndexOf(lastArgumentAssumption);
-          argumentAssumptions = negation.method.Body.Body.Take(lastArgumentAssumptionIndex + 1).OfType<AssumeStmt>()
-            .ToList();
-          argumentFormals = negation.method.Ins.Where(formal => formal.Name.StartsWith(State.FormalNamePrefix)).ToList();
-        }
-        Driver.Log.Debug("Trying simplification:");
-        var querySimplified = new DafnyQuery(query.id, resolvedClassDeclaration.FullDafnyName, resolvedClassDeclaration.FullDafnyName,
-          new List<Method> { method }, previousSimplified, next.State, argumentAssumptions, null, argumentFormals);
-        var canBeSimplified = await querySimplified.VerifyAsync(VerificationUtils.QueryType.Simplify, false, SimplificationTimeLimit);
-        if (canBeSimplified == VerificationResult.Status.Verified) {
-          negation = new(previousSimplified, negation.method);
-          previous = previousSimplified;
-        }
-      
         if (explored.Contains(previous)) {
           continue;
         }
 
-        var queryMethod = negation.method;
         explored.Add(previous);
         
         await heuristic.UpdateHeuristicWithNewPropertiesAsync(previous.Keys.Select(indexedProperty => indexedProperty.Property).ToList());
@@ -214,6 +257,7 @@ public abstract class Search {
         Driver.Log.Info($"The following method sequence is possible (heuristic={stateEstimate}): " +
                  string.Join(", ", next.Methods.Prepend(method).Select(method => method.Name)));
         Driver.Log.Info($"New state is {previous}");
+        Telemetry.Emit("heuristic", new { Sequence = next.Methods.Prepend(method).Select(method => method.Name), Value = stateEstimate });
 
         var statements = new SolutionFormatter().Format(queryMethod.Body.Body, receiverName).Concat(next.Solution).ToList();
         fringe.Enqueue(
@@ -270,6 +314,62 @@ public abstract class Search {
 
   }
 
+  private static bool TimeLimitReached(Driver.Options options) {
+    return DateTime.Now - options.StartTime > new TimeSpan(options.TimeLimit * TimeSpan.TicksPerSecond);
+  }
+
+  /// <summary>
+  /// Find a state from which calling <param name="method"></param> leads to the state of <param name="next"></param>,
+  /// together with the method that calls it with suitable arguments, or a null state if there is none
+  /// </summary>
+  private static async Task<(State state, Method method)> FindPredecessorAsync(ClassDecl resolvedClassDeclaration, Type targetType, SearchNode next, Method method) {
+    Driver.Log.Debug("Trying method sequence: " + string.Join(", ", next.Methods.Prepend(method).Select(method => method.Name)));
+    
+    
+    var query = new DafnyQuery(resolvedClassDeclaration.FullDafnyName, resolvedClassDeclaration.FullDafnyName,
+      new List<Method> { method }, next.State.Negate(),
+      next.State);
+    var negation = await query.InferMethodArgumentsAndObjectStateAsync(VerificationUtils.QueryType.Regular, DefaultTimeLimit, false);
+    var previous = negation.state;
+    if (previous == null) {
+      return negation;
+    }
+
+    // create a state defined only by the properties shared between next and previous:
+    var previousSimplified = new State(targetType, "");
+    foreach (var indexedProperty in previous.Keys.OrderBy(key => key.Index)) {
+      // TODO: there might be well-formedness issues arising here, need to double-check this is sound
+      var matchingProperty = next.State.Keys.FirstOrDefault(key => key.Property == indexedProperty.Property);
+      if (matchingProperty == null) {
+        continue;
+      }
+      if (next.State[matchingProperty] == previous[indexedProperty]) {
+        previousSimplified[indexedProperty] = previous[indexedProperty];
+      }
+    }
+
+    // Reuse the method synthesized above for transforming previous to next 
+    // and see if the same method transforms previousSimplified to next
+    List<AssumeStmt> argumentAssumptions = new List<AssumeStmt>();
+    List<Formal> argumentFormals = new List<Formal>();
+    if (method.Ins.Any()) {
+      var lastArgumentAssumption = negation.method.Body.Body.OfType<AssumeStmt>()
+        .Last(statement => statement.Attributes != null && statement.Attributes.Name == State.AssumptionDescribesArgumentAttribute);
+      var lastArgumentAssumptionIndex = negation.method.Body.Body.IndexOf(lastArgumentAssumption);
+      argumentAssumptions = negation.method.Body.Body.Take(lastArgumentAssumptionIndex + 1).OfType<AssumeStmt>()
+        .ToList();
+      argumentFormals = negation.method.Ins.Where(formal => formal.Name.StartsWith(State.FormalNamePrefix)).ToList();
+    }
+    Driver.Log.Debug("Trying simplification:");
+    var querySimplified = new DafnyQuery(query.id, resolvedClassDeclaration.FullDafnyName, resolvedClassDeclaration.FullDafnyName,
+      new List<Method> { method }, previousSimplified, next.State, argumentAssumptions, null, argumentFormals);
+    var canBeSimplified = await querySimplified.VerifyAsync(VerificationUtils.QueryType.Simplify, false, SimplificationTimeLimit);
+    if (canBeSimplified == VerificationResult.Status.Verified) {
+      return (previousSimplified, negation.method);
+    }
+    return negation;
+  }
+
   private static State GetState(Type targetType, string receiverName, Expression? constraint) {
     var state = new State(targetType, "");
     if (constraint == null) {
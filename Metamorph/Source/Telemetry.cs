@@ -0,0 +1,78 @@
+using System.Text.Json;
+using System.Text.Json.Nodes;
+using NLog;
+
+namespace Synthesis;
+
+/// <summary>
+/// Writes machine-readable events (one JSON object per line) describing a synthesis run, so that scripts can
+/// get exact counters without parsing the human-readable logs. Every event has the time in seconds since
+/// the file was opened ("t") and its kind ("event"), e.g.
+/// {"t":1.25,"event":"queryEnd","query":3,"type":"Regular","status":"Verified","seconds":0.42}
+/// </summary>
+public abstract class Telemetry {
+
+  public const string FileExtension = ".events.jsonl";
+
+  private static readonly object WriterLock = new();
+  private static readonly JsonSerializerOptions JsonOptions = new() {
+    PropertyNamingPolicy = JsonNamingPolicy.CamelCase
+  };
+  private static StreamWriter? writer;
+  private static DateTime began;
+
+  /// <summary>
+  /// Start writing events to a file in the given directory, named after the log file of the current stage
+  /// </summary>
+  public static void Open(string directory) {
+    Close();
+    Directory.CreateDirectory(directory);
+    var path = Path.Combine(directory,
+      $"{GlobalDiagnosticsContext.Get("startTime")}_{GlobalDiagnosticsContext.Get("stage")}{FileExtension}");
+    lock (WriterLock) {
+      writer = new StreamWriter(path, append: false);
+      began = DateTime.Now;
+    }
+  }
+
+  /// <summary>
+  /// Record an event of the given kind. The public properties of <param name="payload"></param> become fields
+  /// of the event. Does nothing unless a file has been opened.
+  /// </summary>
+  public static void Emit(string kind, object? payload = null) {
+    if (writer == null) {
+      return;
+    }
+    var time = (DateTime.Now - began).TotalSeconds;
+    var record = new JsonObject { ["t"] = Math.Round(time, 4), ["event"] = kind };
+    if (payload != null) {
+      var fields = JsonSerializer.SerializeToNode(payload, JsonOptions)!.AsObject();
+      foreach (var (key, value) in fields.ToList()) {
+        fields.Remove(key);
+        record[key] = value;
+      }
+    }
+    lock (WriterLock) {
+      writer?.WriteLine(record.ToJsonString());
+    }
+  }
+
+  /// <summary>
+  /// Summary of the Dafny queries made so far, keyed by query type
+  /// </summary>
+  public static Dictionary<string, object> QuerySummary() {
+    return Enum.GetValues<VerificationUtils.QueryType>().ToDictionary(
+      queryType => queryType.ToString(),
+      queryType => (object) new {
+        Count = VerificationUtils.DafnyQueryCount[queryType],
+        Seconds = VerificationUtils.DafnyQueryTime[queryType].TotalSeconds
+      });
+  }
+
+  public static void Close() {
+    lock (WriterLock) {
+      writer?.Dispose();
+      writer = null;
+    }
+  }
+}
@@ -1,3 +1,5 @@
+using System.Security.Cryptography;
+using System.Text;
 using System.Text.RegularExpressions;
 using Microsoft.Boogie;
 using Microsoft.Boogie.SMTLib;
@@ -23,6 +25,19 @@ public abstract class VerificationUtils {
   public static Dictionary<QueryType, int> DafnyQueryCount { get; private set; } = new();
   public static Dictionary<QueryType, TimeSpan> DafnyQueryTime { get; private set; } = new(); // total time that Dafny queries took
   private static Program unresolvedProgram = null!; // a copy of the original program, unresolved, not to be modified
+  public static Program UnresolvedProgram => unresolvedProgram;
+  private static readonly Regex IncludeRegex = new("^\\s*include\\s+\"([^\"]+)\"", RegexOptions.Multiline);
+  // While queries run concurrently (see RunConcurrentlyAsync), a task must hold this lock whenever it runs. The lock is
+  // only released while a task waits for the solver, since the rest of Metamorph (e.g. the unresolvedProgram modified
+  // in VerifyMethodAsync) is not thread-safe.
+  private static SemaphoreSlim? concurrencyLock;
+  // The time charged to every query in progress (see StartTiming). While several queries are in progress, the time
+  // that passes is split evenly between them, so that the times of all queries add up to at most the wall time.
+  private static readonly Dictionary<int, TimeSpan> queryTimes = new();
+  private static readonly HashSet<int> timedQueries = new();
+  // tasks pause their queries when they stop waiting for the solver, before they hold the concurrency lock again
+  private static readonly object timingLock = new();
+  private static DateTime lastTimingUpdate = DateTime.Now;
   
 
   /// <summary>
@@ -31,6 +46,10 @@ public abstract class VerificationUtils {
   public static void Init() {
     DafnyQueryCount = new Dictionary<QueryType, int>();
     DafnyQueryTime = new();
+    lock (timingLock) {
+      queryTimes.Clear();
+      timedQueries.Clear();
+    }
     foreach (QueryType queryType in Enum.GetValues(typeof(QueryType))) {
       DafnyQueryTime[queryType] = new(0);
       DafnyQueryCount[queryType] = 0;
@@ -40,6 +59,87 @@ public abstract class VerificationUtils {
     var source = new StreamReader(Search.SourceFile).ReadToEnd();
     var errorReporter = new ConsoleErrorReporter(options);
     unresolvedProgram = DafnyTestGeneration.Utils.Parse(errorReporter, source, resolve: false, uri: uri);
+    if (QueryCache.IsEnabled) {
+      QueryCache.SetContext(unresolvedProgram, Search.SourceFile);
+    }
+  }
+
+  /// <summary>
+  /// Run the given tasks so that up to <param name="jobs"></param> of them can wait for Dafny queries at the same time
+  /// </summary>
+  public static async Task RunConcurrentlyAsync(IEnumerable<Func<Task>> tasks, int jobs) {
+    if (jobs <= 1 || concurrencyLock != null) {
+      foreach (var task in tasks) {
+        await task();
+      }
+      return;
+    }
+    concurrencyLock = new SemaphoreSlim(1, 1);
+    var slots = new SemaphoreSlim(jobs, jobs);
+    try {
+      await Task.WhenAll(tasks.Select(async task => {
+        await slots.WaitAsync();
+        await concurrencyLock.WaitAsync();
+        try {
+          await task();
+        } finally {
+          concurrencyLock.Release();
+          slots.Release();
+        }
+      }).ToList());
+    } finally {
+      concurrencyLock = null;
+    }
+  }
+
+  /// <summary>
+  /// A digest of the program and of all the files it includes, leaving out the given members
+  /// </summary>
+  public static string ProgramDigest(Program program, string sourceFile, IEnumerable<(TopLevelDeclWithMembers container, MemberDecl member)> excluded) {
+    var removed = excluded
+      .Select(entry => (entry.container, entry.member, index: entry.container.Members.IndexOf(entry.member)))
+      .Where(entry => entry.index >= 0).ToList();
+    foreach (var (container, member, _) in removed) {
+      container.Members.Remove(member);
+    }
+    var writer = new StringWriter();
+    try {
+      var options = DafnyOptions.Create(new StringWriter(), TextReader.Null, Array.Empty<string>());
+      new Printer(writer, options).PrintProgram(program, false);
+    } finally {
+      foreach (var (container, member, index) in Enumerable.Reverse(removed)) {
+        container.Members.Insert(index, member);
+      }
+    }
+    var parts = new List<string> { writer.ToString() };
+    foreach (var includedFile in IncludedFiles(sourceFile).Where(File.Exists).OrderBy(file => file)) {
+      parts.Add(includedFile);
+      parts.Add(File.ReadAllText(includedFile));
+    }
+    return Digest(parts.ToArray());
+  }
+
+  public static string Digest(params string[] parts) {
+    return Convert.ToHexString(SHA256.HashData(Encoding.UTF8.GetBytes(string.Join("\0", parts))));
+  }
+
+  private static HashSet<string> IncludedFiles(string sourceFile) {
+    var files = new HashSet<string>();
+    var pending = new Stack<string>();
+    pending.Push(Path.GetFullPath(sourceFile));
+    while (pending.Count != 0) {
+      var file = pending.Pop();
+      if (!File.Exists(file)) {
+        continue;
+      }
+      foreach (Match match in IncludeRegex.Matches(File.ReadAllText(file))) {
+        var includedFile = Path.GetFullPath(Path.Combine(Path.GetDirectoryName(file)!, match.Groups[1].Value));
+        if (files.Add(includedFile)) {
+          pending.Push(includedFile);
+        }
+      }
+    }
+    return files;
   }
 
   /// <summary>
@@ -104,6 +204,67 @@ public abstract class VerificationUtils {
   private static readonly TaskFactory LargeStackFactory = new(CancellationToken.None,
     TaskCreationOptions.DenyChildAttach, TaskContinuationOptions.None, LargeThreadScheduler);
 
+  /// <summary>
+  /// Charge the time that passed since the last update to the queries in progress
+  /// </summary>
+  private static void UpdateTiming() {
+    var now = DateTime.Now;
+    if (timedQueries.Count != 0) {
+      var share = (now - lastTimingUpdate) / timedQueries.Count;
+      foreach (var queryId in timedQueries) {
+        queryTimes[queryId] += share;
+      }
+    }
+    lastTimingUpdate = now;
+  }
+
+  private static void StartTiming(int queryId) {
+    lock (timingLock) {
+      UpdateTiming();
+      queryTimes[queryId] = TimeSpan.Zero;
+      timedQueries.Add(queryId);
+    }
+  }
+
+  /// <summary>
+  /// Stop charging time to a query, e.g. while it waits for another task to release the concurrency lock
+  /// </summary>
+  private static void PauseTiming(int queryId) {
+    lock (timingLock) {
+      UpdateTiming();
+      timedQueries.Remove(queryId);
+    }
+  }
+
+  private static void ResumeTiming(int queryId) {
+    lock (timingLock) {
+      UpdateTiming();
+      timedQueries.Add(queryId);
+    }
+  }
+
+  private static TimeSpan StopTiming(int queryId) {
+    lock (timingLock) {
+      UpdateTiming();
+      timedQueries.Remove(queryId);
+      queryTimes.Remove(queryId, out var elapsed);
+      return elapsed;
+    }
+  }
+
+  /// <summary>
+  /// Account for the time a query took and log it, so that the logs can be used to profile individual queries
+  /// </summary>
+  private static VerificationResult FinishQuery(QueryType queryType, int queryId, VerificationResult result, bool cached = false) {
+    var elapsed = StopTiming(queryId);
+    DafnyQueryTime[queryType] += elapsed;
+    Driver.Log.Trace($"Finished {queryType} query {queryId} with status {result.ResultStatus} in {elapsed}" + (cached ? " (cached)" : ""));
+    Telemetry.Emit("queryEnd", new {
+      Query = queryId, Type = queryType.ToString(), Status = result.ResultStatus.ToString(), Seconds = elapsed.TotalSeconds, Cached = cached
+    });
+    return result;
+  }
+
   /// <summary>
   /// Attempt to verify a given method in Dafny.
   /// </summary>
@@ -122,7 +283,9 @@ public abstract class VerificationUtils {
   {
     // Make a note of the time the query started:
     DafnyQueryCount[queryType]++;
-    DateTime verificationBegan = DateTime.Now;
+    var queryId = DafnyQueryCount.Values.Sum();
+    StartTiming(queryId);
+    Telemetry.Emit("queryStart", new { Query = queryId, Type = queryType.ToString() });
     // Setup DafnyOptions:
     var options = DafnyOptions.Create(new StringWriter(), TextReader.Null, Array.Empty<string>());
     options.ApplyDefaultOptions();
@@ -158,14 +321,24 @@ public abstract class VerificationUtils {
         signature = $"static method {DafnyQuery.DefaultMethodName}({ins})";
       }
 
-      Driver.Log.Trace($"Verifying the body of the following method:\n" +
+      Driver.Log.Trace($"Verifying the body of the following method (query {queryId}):\n" +
                        $"{signature} {{" +
                        $"{string.Join("\n", updateStatements.ConvertAll(statement => Printer.StatementToString(DafnyOptions.Default, statement)))}" +
                        $"}}");
 
       // use the following if you want to print the actual method being queried:
-      Driver.Log.Trace($"Verifying the body of the following method (literal):\n {SynthesizedMethodRegex.Match(sourceAsString).Groups[1]}");
+      Driver.Log.Trace($"Verifying the body of the following method (literal, query {queryId}):\n {SynthesizedMethodRegex.Match(sourceAsString).Groups[1]}");
+    }
+
+    QueryCache.Key? cacheKey = null;
+    if (QueryCache.IsEnabled) {
+      cacheKey = new QueryCache.Key(qualifiedClasName, SynthesizedMethodRegex.Match(sourceAsString).Groups[1].Value, assumeAllPreconditions);
+      if (QueryCache.TryGet(cacheKey, out var cachedStatus, out var cachedOutput)) {
+        var cachedModel = cachedStatus == VerificationResult.Status.Counterexample ? DafnyModel.ExtractModel(options, cachedOutput) : null;
+        return FinishQuery(queryType, queryId, new VerificationResult(cachedStatus, method, cachedModel), true);
+      }
     }
+
     var program = DafnyTestGeneration.Utils.Parse(
       new ConsoleErrorReporter(options), 
       sourceAsString, 
@@ -192,27 +365,40 @@ public abstract class VerificationUtils {
         engine.EliminateDeadVariables(boogieProgram); 
         engine.CollectModSets(boogieProgram);
         engine.Inline(boogieProgram);
-        var taskResult = await Task.WhenAny(engine.InferAndVerify(verificationWriter, boogieProgram,
+        var verification = engine.InferAndVerify(verificationWriter, boogieProgram,
             new PipelineStatistics(), null,
-            _ => { }, guid),
-          Task.Delay(TimeSpan.FromSeconds(timeLimit)));
+            _ => { }, guid);
+        // let other tasks prepare their queries while the solver is busy with this one
+        var heldLock = concurrencyLock;
+        heldLock?.Release();
+        Task taskResult;
+        try {
+          taskResult = await Task.WhenAny(verification, Task.Delay(TimeSpan.FromSeconds(timeLimit)));
+        } finally {
+          if (heldLock != null) {
+            // waiting for the other tasks is not part of this query
+            PauseTiming(queryId);
+            await heldLock.WaitAsync();
+            ResumeTiming(queryId);
+          }
+        }
         resultString += verificationWriter.ToString();
         if (taskResult is not Task<PipelineOutcome>) {
           // TODO: Can we support periodical timeouts?
-          Driver.Log.Warn("Encountered a timeout");
-          DafnyQueryTime[queryType] += DateTime.Now - verificationBegan;
-          return new VerificationResult(VerificationResult.Status.Timeout, method);
+          Driver.Log.Warn($"Encountered a timeout in query {queryId}");
+          return FinishQuery(queryType, queryId, new VerificationResult(VerificationResult.Status.Timeout, method));
         }
     }
+    if (cacheKey != null) {
+      QueryCache.Store(cacheKey, resultString.Length == 0 ? VerificationResult.Status.Verified : VerificationResult.Status.Counterexample, resultString);
+    }
     if (resultString.Length == 0) {
-      DafnyQueryTime[queryType] += DateTime.Now - verificationBegan;
-      return new VerificationResult(VerificationResult.Status.Verified, method);
+      return FinishQuery(queryType, queryId, new VerificationResult(VerificationResult.Status.Verified, method));
     }
 
     // TODO: There will be a way to get model models without parsing in Dafny 4.4+.
     var dafnyModel = DafnyModel.ExtractModel(options, resultString);
-    DafnyQueryTime[queryType] += DateTime.Now - verificationBegan;
-    return new VerificationResult(VerificationResult.Status.Counterexample, method, dafnyModel);
+    return FinishQuery(queryType, queryId, new VerificationResult(VerificationResult.Status.Counterexample, method, dafnyModel));
   }
   
   /// <summary>
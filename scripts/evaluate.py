@@ -1,47 +1,43 @@
 import re
+import os
+import fcntl
+import json
+import shutil
 import subprocess
 import sys
-import psutil
-import time
+import tempfile
 import argparse
-from collections import defaultdict
-import matplotlib.pyplot as plt
-import matplotlib
-import numpy as np
-
-# Use Type-1 fonts instead of Type-3
-matplotlib.rcParams['pdf.fonttype'] = 42  # Ensures TrueType fonts are used in PDFs
-matplotlib.rcParams['ps.fonttype'] = 42   # Ensures TrueType fonts are used in PS
-
-# Set a font that works well
-matplotlib.rcParams['font.family'] = 'serif'  # Or 'Times New Roman' for IEEE submissions
-matplotlib.rcParams['text.usetex'] = False    # Disable LaTeX rendering to avoid unexpected Type-3 fonts
+from metamorph_worker import WorkerPool
+from process_timing import run_process
+from results_cache import Outcome, Result, ResultsCache, directory_digest, fingerprint, source_digest
+from scheduler import Chain, Job, Scheduler
+from telemetry import find_events_files, read_summary
 
 DEFAULT_TIME_LIMIT = 1440
 RESULTS_FILE = "cache/Results.csv"
+RESULTS_DB = "cache/Results.db"
 PRETRAINED_DIR = "cache/pretraining"
-BASELINE_CACHE = "cache/baseline"
+SCRATCH_DIR = "cache/scratch"
+LOGS_DIR = "cache/logs"
+QUERIES_DIR = "cache/queries"
+SOLUTIONS_DIR = "cache/solutions"
+BASELINE_DIR = "cache/baseline"
 EVM_BENCHMARK = "EVM"
 BENCHMARKS_FIGURE_8 = ["FreezableArray", "BinaryTree", "SocialNetwork", "Firewall", "DoublyLinkedList", "Queue"]
 BENCHMARKS_FIGURE_10 = ["FreezableArrayMod", "SocialNetworkMod"]
+# names of groups of benchmarks on the command line (see -benchmark)
+FIGURE_8 = "Figure8"
+FIGURE_10 = "Figure10"
+EVERYTHING = "ALL"
+BENCHMARK_CHOICES = BENCHMARKS_FIGURE_8 + BENCHMARKS_FIGURE_10 + [FIGURE_8, FIGURE_10, EVM_BENCHMARK, EVERYTHING]
 BENCHMARKS_DIR = "Benchmarks"
 PROBLEM_INDEX_FILE_NAME = "ProblemIndex.csv"
-METAMORPH = "dotnet Metamorph/Binaries/Metamorph.dll"
-DAFNY = "dotnet Metamorph/dafny/Binaries/Dafny.dll"
+METAMORPH_BINARIES = "Metamorph/Binaries"
+DAFNY_BINARIES = "Metamorph/dafny/Binaries"
+METAMORPH = ["dotnet", f"{METAMORPH_BINARIES}/Metamorph.dll"]
+DAFNY = ["dotnet", f"{DAFNY_BINARIES}/Dafny.dll"]
 HEADER = "Benchmark,TimeLimit,Method,Problem,Outcome,RunningTime\n"
-
-
-class Outcome:
-    SUCCESS = "SUCCESS"
-    TIMEOUT = "TIMEOUT"
-    FAILED = "FAILED"
-
-
-class Result:
-
-    def __init__(self, outcome, running_time):
-        self.outcome = outcome
-        self.running_time = running_time
+REPORT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report.py")
 
 
 class Method:
@@ -49,220 +45,463 @@ class Method:
     NO_DISTANCE_METRIC = "Metamorph (No Distance Metric)"
     GREEDY_DISTANCE_METRIC = "Metamorph (Greedy Metric)"
     PIECEWISE_DISTANCE_METRIC = "Metamorph (Piecewise Metric)"
+    PORTFOLIO = "Metamorph (Portfolio)"
     PRETRAINING = "Pretrain"
 
 
-def time_process(process, time_limit):
-    process_instance = psutil.Process(process.pid)
-    start_time = process_instance.create_time()
-    while True:
-        if (time.time() - start_time) > time_limit:
-            process_instance.kill()
-            break
-        if process_instance.status() != "running":
-            break
-        time.sleep(1)
-    process.wait() # make sure all output is written
-    elapsed = time.time() - start_time
-    if elapsed > time_limit:
-        return Result(Outcome.TIMEOUT, elapsed)
-    return Result(Outcome.SUCCESS, elapsed)
-
-
-def read_results_cache():
-    result = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: {})))
-    with open(RESULTS_FILE, "r") as f:
-        lines = f.readlines()
-        for line in lines[1:]:
-            benchmark, timelimit, method, problem, outcome, time = line.strip().split(",")
-            time = float(time)
-            timelimit = int(timelimit)
-            result[benchmark][timelimit][method][problem] = Result(outcome, time)
-    return result
+# names of the methods on the command line (see -methods)
+METHOD_NAMES = {
+    "piecewise": Method.PIECEWISE_DISTANCE_METRIC,
+    "greedy": Method.GREEDY_DISTANCE_METRIC,
+    "noDistanceMetric": Method.NO_DISTANCE_METRIC,
+    "baseline": Method.BASELINE,
+    "portfolio": Method.PORTFOLIO,
+}
+METHOD_KEYS = {method: name for name, method in METHOD_NAMES.items()}
+# methods that load the data computed by pretraining
+PRETRAINED_METHODS = [Method.PIECEWISE_DISTANCE_METRIC, Method.PORTFOLIO]
+# outcomes after which the more complex problems of a method are not run
+STOPPING_OUTCOMES = [Outcome.TIMEOUT, Outcome.MEMOUT]
+
+
+def to_result(timing, time_limit):
+    timed_out = timing.timed_out or (time_limit is not None and timing.wall_time > time_limit)
+    outcome = Outcome.TIMEOUT if timed_out else Outcome.SUCCESS
+    if timing.memory_exceeded:
+        outcome = Outcome.MEMOUT
+    return Result(outcome, timing.wall_time, timing.cpu_time, timing.peak_rss)
+
 
+def time_process(args, time_limit, job, stdout=None):
+    return to_result(run_process(args, time_limit, stdout, job.attach, job.memory_limit), time_limit)
 
-def pretrain_metamorph(file, pretrained_dir):
-    metamorph = subprocess.Popen(
-        f"{METAMORPH} --input {file} --pretrain {pretrained_dir}",
-        shell=True,
-        stdin=subprocess.DEVNULL,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        universal_newlines=True)
-    result = time_process(metamorph, 10_000_000)
-    return result.running_time
 
+def run_metamorph_process(args, time_limit, job, workers, stdout=None):
+    if workers is None:
+        return run_process(METAMORPH + args, time_limit, stdout, job.attach, job.memory_limit)
+    return workers.get().run(args, time_limit, stdout, job.attach, job.memory_limit)
 
-def run_metamorph(file, time_limit, pretrained_dir, method):
+
+def time_metamorph(args, time_limit, job, workers, stdout=None):
+    return to_result(run_metamorph_process(args, time_limit, job, workers, stdout), time_limit)
+
+
+def open_results_cache():
+    migrate = not os.path.exists(RESULTS_DB)
+    results_cache = ResultsCache(RESULTS_DB)
+    if migrate:
+        # results recorded before the database existed are assumed to match the current sources and binaries
+        import_results(results_cache, RESULTS_FILE)
+    return results_cache
+
+
+def import_results(results_cache, file):
+    entries = []
+    with open(file, "r") as f:
+        for line in f.readlines()[1:]:
+            benchmark, time_limit, method, problem, outcome, time = line.strip().split(",")
+            time_limit = int(time_limit)
+            entries.append((benchmark, time_limit, method, problem,
+                            result_fingerprint(benchmark, method, problem), Result(outcome, float(time))))
+    results_cache.store_all(entries)
+    print(f"Imported {len(entries)} results from {file}.")
+
+
+def method_args(method, pretrained_dir, queries_dir=None, search_jobs=1):
+    args = ["--queryCache", queries_dir] if queries_dir is not None else []
+    if search_jobs > 1:
+        args += ["--jobs", str(search_jobs)]
     if method == Method.NO_DISTANCE_METRIC:
-        extra_args = "--noDistanceMetric"
+        return args + ["--noDistanceMetric"]
     elif method == Method.PIECEWISE_DISTANCE_METRIC:
-        extra_args = f"--loadPretrained {pretrained_dir}"
-    else:
-        extra_args = f" --greedy"
-
-    metamorph = subprocess.Popen(
-        f"{METAMORPH} --input {file} --timeLimit {time_limit} {extra_args} > {BASELINE_CACHE}/result.txt",
-        shell=True,
-        stdin=subprocess.DEVNULL,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        universal_newlines=True)
-    result = time_process(metamorph, time_limit)
-    if result.outcome == Outcome.TIMEOUT:
+        return args + ["--loadPretrained", pretrained_dir]
+    elif method == Method.PORTFOLIO:
+        return args + ["--portfolio", "--loadPretrained", pretrained_dir]
+    return args + ["--greedy"]
+
+
+def query_cache_dir(benchmark, query_cache):
+    return f"{QUERIES_DIR}/{benchmark}" if query_cache else None
+
+
+def prepare_query_cache(benchmark):
+    # cached query results are only valid for the binaries that computed them
+    directory = query_cache_dir(benchmark, True)
+    binaries = directory_digest(METAMORPH_BINARIES)
+    fingerprint_file = f"{directory}/fingerprint"
+    if os.path.exists(fingerprint_file) and open(fingerprint_file).read() != binaries:
+        print(f"Metamorph has changed since the query cache for {benchmark} was filled, so clearing it.")
+        shutil.rmtree(directory)
+    os.makedirs(directory, exist_ok=True)
+    with open(fingerprint_file, "w") as file:
+        file.write(binaries)
+
+
+def result_fingerprint(benchmark, method, problem, query_cache=False, pretrain_jobs=1, seed=False, repeat=0,
+                       search_jobs=1):
+    # everything a result depends on apart from the time limit, which is part of the key anyway
+    if repeat > 0:
+        # every repetition of a run is a result of its own, the first one is the usual result
+        return fingerprint(result_fingerprint(benchmark, method, problem, query_cache, pretrain_jobs, seed,
+                                              search_jobs=search_jobs),
+                           "--repeat", repeat)
+    benchmark_dir = f"{BENCHMARKS_DIR}/{benchmark}"
+    if method == Method.PRETRAINING:
+        # pretraining with several jobs learns the same facts, but faster
+        jobs = ["--jobs", str(pretrain_jobs)] if pretrain_jobs > 1 else []
+        return fingerprint(method, *jobs, source_digest(f"{benchmark_dir}/Definitions.dfy"),
+                           directory_digest(METAMORPH_BINARIES))
+    if method == Method.BASELINE:
+        config = problem_index(benchmark)
+        line = next((line for line in config[1:] if line[1] == problem), None)
+        if line is None:
+            return fingerprint(method, "missing")
+        # "timed test": results from before the test stage counted towards the running time are not reused
+        return fingerprint(method, "timed test", source_digest(f"{benchmark_dir}/{line[0]}"),
+                           source_digest(f"{benchmark_dir}/{problem}"), *line[2:],
+                           directory_digest(DAFNY_BINARIES))
+    # runs with a query cache or several search jobs are faster, so their results are kept apart from those of runs
+    # without them
+    args = method_args(method, f"{PRETRAINED_DIR}/{benchmark}", query_cache_dir(benchmark, query_cache), search_jobs)
+    if seed:
+        # likewise for runs seeded with the solution of the previous problem
+        previous = previous_problem(benchmark, problem)
+        args += ["--seed", source_digest(f"{benchmark_dir}/{previous}") if previous is not None else "none"]
+    return fingerprint(method, *args,
+                       source_digest(f"{benchmark_dir}/{problem}"), directory_digest(METAMORPH_BINARIES))
+
+
+def problem_index(benchmark):
+    config = open(f"{BENCHMARKS_DIR}/{benchmark}/{PROBLEM_INDEX_FILE_NAME}").readlines()
+    return [line.strip("\n").split(",") for line in config]
+
+
+def previous_problem(benchmark, problem):
+    # problems are listed in order of growing size, so each problem extends the one before it
+    problems = [line[1] for line in problem_index(benchmark)[1:]]
+    index = problems.index(problem) if problem in problems else 0
+    return problems[index - 1] if index > 0 else None
+
+
+def solution_file(benchmark, method, problem):
+    return f"{SOLUTIONS_DIR}/{benchmark}/{METHOD_KEYS[method]}/{os.path.basename(problem)}"
+
+
+def seed_file(benchmark, method, problem):
+    previous = previous_problem(benchmark, problem)
+    if previous is None or not os.path.exists(solution_file(benchmark, method, previous)):
+        return None
+    return solution_file(benchmark, method, previous)
+
+
+def save_solution(output_file, benchmark, method, problem, result):
+    # only keep solutions that can seed the next problem, so that a failed run never leaves a stale one behind
+    path = solution_file(benchmark, method, problem)
+    if result.outcome == Outcome.SUCCESS:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(output_file, path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def append_result(benchmark, time_limit, method, problem, result):
+    # several evaluation scripts may append to the same file, so hold an exclusive lock while writing
+    with open(RESULTS_FILE, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        file.write(f"{benchmark},{time_limit},{method},{problem},{result.outcome},{result.running_time}\n")
+        file.flush()
+
+
+def pretrain_metamorph(file, pretrained_dir, pretrain_jobs, job, workers):
+    return time_metamorph(["--input", file, "--pretrain", pretrained_dir, "--jobs", str(pretrain_jobs)],
+                          None, job, workers)
+
+
+def run_metamorph(file, time_limit, pretrained_dir, queries_dir, method, scratch_dir, job, workers, seed=None,
+                  search_jobs=1):
+    timing = run_metamorph_process(
+        ["--input", file, "--timeLimit", str(time_limit), "--telemetry", scratch_dir] +
+        method_args(method, pretrained_dir, queries_dir, search_jobs) + (["--seed", seed] if seed is not None else []),
+        time_limit, job, workers, f"{scratch_dir}/result.txt")
+    result = to_result(timing, time_limit)
+    summaries = []
+    for events_file in find_events_files(scratch_dir):
+        summaries.append(read_summary(events_file))
+        # keep the events next to the log of the same run, where running_time_analysis.py looks for them
+        os.makedirs(LOGS_DIR, exist_ok=True)
+        os.replace(events_file, f"{LOGS_DIR}/{os.path.basename(events_file)}")
+    # a portfolio has a summary for every strategy that finished, the successful one decides the outcome
+    summaries = [summary for summary in summaries if summary is not None]
+    summary = next((summary for summary in summaries if summary.outcome == "Success"),
+                   summaries[-1] if summaries else None)
+    if result.outcome in STOPPING_OUTCOMES:
         return result
-    output = "".join(open(f"{BASELINE_CACHE}/result.txt").readlines())
-    if "Failed" in output:
-        return Result(Outcome.FAILED, result.running_time)
+    # every run that finishes writes a summary, so a run without one crashed or was killed
+    if summary is None:
+        result.outcome = Outcome.FAILED
+        return result
+    result.strategy = summary.strategy
+    if summary.outcome == "Timeout":
+        result.outcome = Outcome.TIMEOUT
+    elif summary.outcome != "Success" or timing.return_code != 0:
+        # Metamorph only exits with 0 if it found a solution
+        result.outcome = Outcome.FAILED
     return result
 
 
-def run_baseline(config_dir, config_header, config_line, time_limit):
-    template = "".join(open(config_dir + config_line[0]).readlines())
-    template = re.sub(f"\\[File]", "../../" + config_dir + config_line[1], template)
-    for i in range(2, len(config_header)):
-        template = re.sub(f"\\[{config_header[i]}]", config_line[i], template)
-    with open(f"{BASELINE_CACHE}/tmp.dfy", "w") as file:
-        file.write(template)
-    testGeneration = subprocess.Popen(
-        f"{DAFNY} generate-tests Block "
-        f"--verbose --one-test-only --verification-time-limit {time_limit} "
-        f"{BASELINE_CACHE}/tmp.dfy > {BASELINE_CACHE}/tmpTests.dfy",
-        shell=True,
-        stdin=subprocess.DEVNULL,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        universal_newlines=True)
-    result = time_process(testGeneration, time_limit)
-    if result.outcome == Outcome.TIMEOUT:
-        return result
-    testing = subprocess.Popen(
-        f"{DAFNY} test "
-        f"{BASELINE_CACHE}/tmpTests.dfy > {BASELINE_CACHE}/tmpTestsResults.txt",
-        shell=True,
-        stdin=subprocess.DEVNULL,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-        universal_newlines=True)
-    testingProcess = psutil.Process(testing.pid)
-    while True:
-        if testingProcess.status() != "running":
-            break
-        time.sleep(1)
-    testing.wait()
-    testResults = "".join(open(f"{BASELINE_CACHE}/tmpTestsResults.txt").readlines())
-    if "Synthesis goal reached" in testResults:
+def run_problem(benchmark, method, problem, time_limit, job, workers, query_cache=False, seed_solution=None,
+                search_jobs=1):
+    with tempfile.TemporaryDirectory(dir=SCRATCH_DIR) as scratch_dir:
+        result = run_metamorph(f"{BENCHMARKS_DIR}/{benchmark}/{problem}", time_limit,
+                               f"{PRETRAINED_DIR}/{benchmark}", query_cache_dir(benchmark, query_cache),
+                               method, scratch_dir, job, workers, seed_solution, search_jobs)
+        save_solution(f"{scratch_dir}/result.txt", benchmark, method, problem, result)
         return result
-    return Result(Outcome.FAILED, result.running_time)
 
 
-def gather_data(benchmark, method, time_limit, results_cache):
-    with open(RESULTS_FILE, "a") as file:
-        if method == Method.PIECEWISE_DISTANCE_METRIC:
-            if Method.PRETRAINING in results_cache[benchmark][-1]:
-                print(f"Using cached pretraining results.")
-            else:
-                print(f"Pretraining Metamorph on benchmark {benchmark}...")
-                pretrain_time = pretrain_metamorph(
-                    f"{BENCHMARKS_DIR}/{benchmark}/Definitions.dfy",
-                    f"{PRETRAINED_DIR}/{benchmark}")
-                file.write(f"{benchmark},-1,{Method.PRETRAINING},{Method.PRETRAINING},{Outcome.SUCCESS},{pretrain_time}\n")
-                file.flush()
-                results_cache[benchmark][-1][Method.PRETRAINING][Method.PRETRAINING] = Result(Outcome.SUCCESS,pretrain_time)
-                print(f"\rPretraining Metamorph on benchmark {benchmark} took {pretrain_time} seconds...")
-        config = open(f"{BENCHMARKS_DIR}/{benchmark}/{PROBLEM_INDEX_FILE_NAME}").readlines()
-        config = [line.strip("\n").split(",") for line in config]
-        for line in config[1:]:
-            problem = line[1]
-            if problem in results_cache[benchmark][time_limit][method]:
-                print(f"Using cache to load the results of running {method} "
-                      f"on {problem} with time limit of {time_limit} seconds.")
-                if results_cache[benchmark][time_limit][method][problem].outcome == Outcome.TIMEOUT:
-                    print(f"Reached a timeout, so will not process more complex problems with method {method}.")
-                    break
-                continue  # results already in cache
-            print(f"Running {method} on {problem} with time limit of {time_limit} seconds...")
-            if method == Method.BASELINE:
-                result = run_baseline(f"{BENCHMARKS_DIR}/{benchmark}/", config[0], line, time_limit)
-            else:
-                result = run_metamorph(f"{BENCHMARKS_DIR}/{benchmark}/{problem}", time_limit, f"{PRETRAINED_DIR}/{benchmark}", method)
-            file.write(f"{benchmark},{time_limit},{method},{problem},{result.outcome},{result.running_time}\n")
-            file.flush()
-            results_cache[benchmark][time_limit][method][problem] = result
-            print(f"\rRunning {method} on {problem} with time limit of {time_limit} "
-                  f"seconds took {result.running_time} seconds")
-            if result.outcome == Outcome.TIMEOUT:
-                print(f"Reached a timeout, so will not process more complex problems with method {method}.")
+def render_template(template, substitutions):
+    # a single pass over the template, which only replaces the given placeholders (it also uses brackets for indexing)
+    pattern = re.compile(r"\[(" + "|".join(re.escape(name) for name in substitutions) + r")]")
+    return pattern.sub(lambda match: substitutions[match.group(1)], template)
+
+
+def generate_baseline_tests(config_dir, config_header, config_line, time_limit, job, repeat=0):
+    """The first stage of the baseline: render the template for a problem and generate a test from it.
+
+    The template and the test are kept in a directory of BASELINE_DIR named after everything they depend on,
+    so that they are generated only once (per repetition). Returns the result of the generation and the directory."""
+    # all artifact directories are at the same depth, so the relative path to the problem is the same in all of them
+    substitutions = {"File": os.path.relpath(config_dir + config_line[1], f"{BASELINE_DIR}/artifacts")}
+    substitutions.update(zip(config_header[2:], config_line[2:]))
+    template = render_template(open(config_dir + config_line[0]).read(), substitutions)
+    key = fingerprint(template, source_digest(config_dir + config_line[1]), directory_digest(DAFNY_BINARIES),
+                      time_limit, *(["--repeat", repeat] if repeat > 0 else []))
+    artifact_dir = f"{BASELINE_DIR}/{key}"
+    generation_file = f"{artifact_dir}/generation.json"
+    if os.path.exists(generation_file):
+        with open(generation_file) as file:
+            saved = json.load(file)
+        return Result(Outcome.SUCCESS, saved["running_time"], saved["cpu_time"], saved["peak_rss"]), artifact_dir
+    os.makedirs(artifact_dir, exist_ok=True)
+    with open(f"{artifact_dir}/tmp.dfy", "w") as file:
+        file.write(template)
+    result = time_process(
+        DAFNY + ["generate-tests", "Block", "--verbose", "--one-test-only",
+                 "--verification-time-limit", str(time_limit), f"{artifact_dir}/tmp.dfy"],
+        time_limit, job, f"{artifact_dir}/tmpTests.dfy")
+    if result.outcome == Outcome.SUCCESS and not job.cancelled.is_set():
+        # written last, so that an interrupted generation is never reused
+        with open(f"{generation_file}.tmp", "w") as file:
+            json.dump({"running_time": result.running_time, "cpu_time": result.cpu_time,
+                       "peak_rss": result.peak_rss}, file)
+        os.replace(f"{generation_file}.tmp", generation_file)
+    return result, artifact_dir
+
+
+def test_baseline(artifact_dir, generation, time_limit, job):
+    """The second stage of the baseline: compile and run the generated test.
+
+    Both stages share the problem's time limit, so the test gets whatever time the generation left, and both count
+    towards the running time, so that the result holds for any time limit of at least that running time."""
+    if generation.outcome in STOPPING_OUTCOMES:
+        return Result(generation.outcome, generation.running_time, generation.cpu_time, generation.peak_rss)
+    with tempfile.TemporaryDirectory(dir=SCRATCH_DIR) as scratch_dir:
+        testing = time_process(
+            DAFNY + ["test", f"{artifact_dir}/tmpTests.dfy"],
+            time_limit - generation.running_time, job, f"{scratch_dir}/tmpTestsResults.txt")
+        cpu_times = [generation.cpu_time, testing.cpu_time]
+        peak_rss = [rss for rss in [generation.peak_rss, testing.peak_rss] if rss is not None]
+        result = Result(testing.outcome, generation.running_time + testing.running_time,
+                        sum(cpu_times) if None not in cpu_times else None, max(peak_rss, default=None))
+        if testing.outcome in STOPPING_OUTCOMES:
+            return result
+        testResults = "".join(open(f"{scratch_dir}/tmpTestsResults.txt").readlines())
+    if "Synthesis goal reached" not in testResults:
+        result.outcome = Outcome.FAILED
+    return result
+
+
+def schedule_pretraining(benchmark, results_cache, scheduler, workers, pretrain_jobs=1):
+    # pretraining is not subject to the memory limit, since every other run of the benchmark depends on it
+    result_key = (benchmark, -1, Method.PRETRAINING, Method.PRETRAINING,
+                  result_fingerprint(benchmark, Method.PRETRAINING, Method.PRETRAINING, pretrain_jobs=pretrain_jobs))
+    if results_cache.lookup(*result_key) is not None:
+        print(f"Using cached pretraining results.")
+        return None
+
+    def run(job):
+        print(f"Pretraining Metamorph on benchmark {benchmark}...")
+        return pretrain_metamorph(
+            f"{BENCHMARKS_DIR}/{benchmark}/Definitions.dfy",
+            f"{PRETRAINED_DIR}/{benchmark}",
+            pretrain_jobs,
+            job,
+            workers)
+
+    def commit(result):
+        append_result(benchmark, -1, Method.PRETRAINING, Method.PRETRAINING, result)
+        results_cache.store(*result_key, result)
+        print(f"\rPretraining Metamorph on benchmark {benchmark} took {result.describe()}...")
+
+    memory = results_cache.peak_rss(benchmark, Method.PRETRAINING, Method.PRETRAINING)
+    return scheduler.add_chain(Chain([Job(f"Pretraining on {benchmark}", run, commit, memory=memory)]))
+
+
+def cached_result(results_cache, result_key, memory_limit=None):
+    cached = results_cache.infer(*result_key)
+    if cached is not None and cached.outcome == Outcome.MEMOUT and \
+            (memory_limit is None or cached.peak_rss is None or memory_limit > cached.peak_rss):
+        return None  # the run might succeed with the current memory limit
+    return cached
+
+
+def gather_data(benchmark, method, time_limit, results_cache, scheduler, workers, depends_on=None, query_cache=False,
+                seed=False, memory_limit=None, repeat=0, search_jobs=1):
+    config = problem_index(benchmark)
+    seed = seed and method != Method.BASELINE
+    repetition = f" (repetition {repeat + 1})" if repeat > 0 else ""
+
+    def commit_result(problem, result_key):
+        def commit(result):
+            append_result(benchmark, time_limit, method, problem, result)
+            results_cache.store(*result_key, result)
+            print(f"\rRunning {method} on {problem}{repetition} with time limit of {time_limit} "
+                  f"seconds took {result.describe()}")
+            report_stop(result)
+
+        return commit
+
+    def report_stop(result):
+        if result.outcome == Outcome.TIMEOUT:
+            print(f"Reached a timeout, so will not process more complex problems with method {method}.")
+        elif result.outcome == Outcome.MEMOUT:
+            print(f"Ran out of memory, so will not process more complex problems with method {method}.")
+
+    def baseline_jobs(line, result_key, memory):
+        # test generation for a problem can overlap with testing for the previous one
+        problem = line[1]
+        stages = {}
+
+        def generate(job):
+            print(f"Running {method} on {problem}{repetition} with time limit of {time_limit} seconds...")
+            stages["generation"], stages["artifact_dir"] = generate_baseline_tests(
+                f"{BENCHMARKS_DIR}/{benchmark}/", config[0], line, time_limit, job, repeat)
+            return stages["generation"]
+
+        def test(job):
+            return test_baseline(stages["artifact_dir"], stages["generation"], time_limit, job)
+
+        commit = commit_result(problem, result_key)
+        # a generation that timed out or ran out of memory stops the chain, so its result is committed right away
+        generation = Job(f"Generating a test for {benchmark}/{problem}{repetition}", generate,
+                         lambda result: commit(result) if result.outcome in STOPPING_OUTCOMES else None,
+                         memory=memory, memory_limit=memory_limit)
+        return [generation, Job(f"{method} on {benchmark}/{problem}{repetition}", test, commit, after=generation,
+                                memory=memory, memory_limit=memory_limit)]
+
+    def problem_job(line, result_key, memory):
+        problem = line[1]
+
+        def run(job):
+            print(f"Running {method} on {problem}{repetition} with time limit of {time_limit} seconds...")
+            seed_solution = seed_file(benchmark, method, problem) if seed else None
+            if seed_solution is not None:
+                print(f"Seeding {method} on {problem} with the solution of {previous_problem(benchmark, problem)}.")
+            return run_problem(benchmark, method, problem, time_limit, job, workers, query_cache, seed_solution,
+                               search_jobs)
+
+        return Job(f"{method} on {benchmark}/{problem}{repetition}", run, commit_result(problem, result_key),
+                   memory=memory, memory_limit=memory_limit)
+
+    jobs = []
+    memory = None
+    for line in config[1:]:
+        problem = line[1]
+        result_key = (benchmark, time_limit, method, problem,
+                      result_fingerprint(benchmark, method, problem, query_cache, seed=seed, repeat=repeat,
+                                         search_jobs=search_jobs))
+        # problems are ordered by size, so a problem is expected to need at least as much memory as the one before
+        memory = max(filter(None, [memory, results_cache.peak_rss(benchmark, method, problem)]), default=None)
+        if memory is not None and memory_limit is not None:
+            memory = min(memory, memory_limit)
+        cached = cached_result(results_cache, result_key, memory_limit)
+        if cached is not None:
+            print(f"Using cache to load the results of running {method} "
+                  f"on {problem}{repetition} with time limit of {time_limit} seconds.")
+            if cached.inferred_from is not None:
+                print(f"The result ({cached.outcome}) is inferred from a run with time limit of "
+                      f"{cached.inferred_from} seconds.")
+            if cached.outcome in STOPPING_OUTCOMES:
+                report_stop(cached)
                 break
+            continue  # results already in cache
+        if method == Method.BASELINE:
+            jobs += baseline_jobs(line, result_key, memory)
+        else:
+            jobs.append(problem_job(line, result_key, memory))
+    # problems are ordered by size, so once a problem times out or runs out of memory, there is no point in running
+    # larger ones. A seeded problem needs the solution of the one before it, so seeded problems cannot run ahead.
+    return scheduler.add_chain(Chain(jobs, lambda result: result.outcome in STOPPING_OUTCOMES, depends_on,
+                                     speculative=not seed))
+
+
+def select_benchmarks(choice):
+    if choice == FIGURE_8:
+        return BENCHMARKS_FIGURE_8
+    if choice == FIGURE_10:
+        return BENCHMARKS_FIGURE_10
+    if choice == EVERYTHING:
+        return BENCHMARKS_FIGURE_8 + BENCHMARKS_FIGURE_10 + [EVM_BENCHMARK]
+    return [choice]
 
 
-def plot_evm_table(results_cache, time_limit):
-    with open("Table1.csv", "w") as file:
-        file.write(f"Problem,{Method.PIECEWISE_DISTANCE_METRIC},{Method.GREEDY_DISTANCE_METRIC}\n")
-        problems = list(results_cache[EVM_BENCHMARK][time_limit][Method.PIECEWISE_DISTANCE_METRIC].keys())
-        for problem in problems:
-            file.write(f"{problem},"
-                       f"{results_cache[EVM_BENCHMARK][time_limit][Method.PIECEWISE_DISTANCE_METRIC][problem].running_time},"
-                       f"{results_cache[EVM_BENCHMARK][time_limit][Method.GREEDY_DISTANCE_METRIC][problem].running_time}\n")
-
-
-def plot_figure(benchmark, results_cache, time_limit):
-    data = {}
-    for method in results_cache[benchmark][time_limit].keys():
-        if method == Method.PRETRAINING:
-            continue
-        data[method] = ([], [])
-        for problem in sorted(results_cache[benchmark][time_limit][method].keys()):
-            match = re.search(r'\d+', problem)
-            if not match:
-               continue
-            problem_id = int(match.group())
-            result = results_cache[benchmark][time_limit][method][problem]
-            if result.outcome == Outcome.TIMEOUT:
-                result.time = time_limit
-            elif result.outcome == Outcome.FAILED:
-                continue
-            data[method][0].append(problem_id)
-            data[method][1].append(result.running_time/60)
-    fig, ax = plt.subplots(layout='constrained')
-    line_styles = ["-", "--", "-.", ":"]
-    for id, approach in enumerate(data.keys()):
-        plt.plot(data[approach][0], data[approach][1],
-                 label=approach, linestyle=line_styles[id], linewidth=6)
-    plt.plot(np.arange(20), [time_limit/60] * 20,
-             linestyle="--", color="red", linewidth=6)
-    ax.annotate("Timeout", xy=(17, 150), xytext=(
-        17, 150), color="red", fontsize=36)
-    
-    if benchmark == "BinaryTree":
-        plt.legend(loc='center right', fontsize=50, bbox_to_anchor=(1, 0.6))
-    else:
-        plt.legend(loc='lower right', fontsize=50)
-    ax.set_ylabel('Running time (min)', fontsize=50)
-    ax.set_xlabel('Object size', fontsize=50)
-    ax.tick_params(axis='x', labelsize=36)
-    ax.tick_params(axis='y', labelsize=36)
-    fig.set_size_inches(24, 16)
-    ax.set_yscale('log')
-    ax.set_xticks(range(0, 20))
-    # line below makes it easier to compare results compiled with different time limits
-    ax.set_ylim(1/60, DEFAULT_TIME_LIMIT)
-    plt.savefig(f'{benchmark}.pdf')
-
-
-def main(time_limit, benchmarks):
-    results_cache = read_results_cache()
+def problem_size(problem):
+    # the object size is the number in the name of the problem
+    match = re.search(r'\d+', problem)
+    return int(match.group()) if match else None
+
+
+def benchmark_methods(benchmark, selected=None):
+    methods = [Method.PIECEWISE_DISTANCE_METRIC, Method.GREEDY_DISTANCE_METRIC]
+    if benchmark in BENCHMARKS_FIGURE_8:
+        methods += [Method.NO_DISTANCE_METRIC, Method.BASELINE]
+    if selected is None:
+        return methods
+    # the portfolio is not part of the paper's figures, so it only runs when asked for
+    return [method for method in methods + [Method.PORTFOLIO] if method in selected]
+
+
+def main(results_cache, time_limit, benchmarks, jobs, warm=False, query_cache=False, pretrain_jobs=1, methods=None,
+         seed=False, memory_limit=None, memory_budget=None, repeats=1, report=True, search_jobs=1):
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    scheduler = Scheduler(jobs, memory_budget)
+    # the baseline always starts a fresh Dafny process, since Dafny has no mode for serving several jobs
+    workers = WorkerPool(METAMORPH) if warm else None
     for benchmark in benchmarks:
         print(f"Processing benchmark {benchmark}")
-        methods = [Method.PIECEWISE_DISTANCE_METRIC, Method.GREEDY_DISTANCE_METRIC]
-        if benchmark in BENCHMARKS_FIGURE_8:
-            methods += [Method.NO_DISTANCE_METRIC, Method.BASELINE]
-        for method in methods:
-            gather_data(benchmark, method, time_limit, results_cache)
-        if benchmark == EVM_BENCHMARK:
-            plot_evm_table(results_cache, time_limit)
-        else:
-            plot_figure(benchmark, results_cache, time_limit)
+        if query_cache:
+            prepare_query_cache(benchmark)
+        pretraining = None
+        if any(method in PRETRAINED_METHODS for method in benchmark_methods(benchmark, methods)):
+            pretraining = schedule_pretraining(benchmark, results_cache, scheduler, workers, pretrain_jobs)
+        # with a single job, all problems run once before any of them is repeated
+        for repeat in range(repeats):
+            for method in benchmark_methods(benchmark, methods):
+                depends_on = pretraining if method in PRETRAINED_METHODS else None
+                gather_data(benchmark, method, time_limit, results_cache, scheduler, workers, depends_on, query_cache,
+                            seed, memory_limit, repeat, search_jobs)
+    try:
+        scheduler.run()
+    finally:
+        if workers is not None:
+            workers.close()
+    if report:
+        # plotting runs in a process of its own, so that running experiments never has to load matplotlib
+        subprocess.run([sys.executable, REPORT_SCRIPT, "-timeLimit", str(time_limit), "-benchmarks", *benchmarks] +
+                       (["-methods", *(METHOD_KEYS[method] for method in methods)] if methods else []) +
+                       (["--queryCache"] if query_cache else []) + (["--seed"] if seed else []) +
+                       (["-searchJobs", str(search_jobs)] if search_jobs > 1 else []),
+                       check=True)
 
 
 if __name__ == "__main__":
@@ -271,26 +510,73 @@ if __name__ == "__main__":
     p.add_argument("-timeLimit", type=int,
                    help=f"Time limit (in seconds) after which the process will be killed on each synthesis problem.",
                    required=True)
-    figure_8_str = "Figure8"
-    figure_10_str = "Figure10"
-    everything_str = "ALL"
-    benchmark_choices = BENCHMARKS_FIGURE_8 + BENCHMARKS_FIGURE_10 + [figure_8_str, figure_10_str, EVM_BENCHMARK, everything_str]
-    p.add_argument('-benchmark', choices=benchmark_choices,
+    p.add_argument('-benchmark', choices=BENCHMARK_CHOICES,
                    help=f"The benchmark to run the experiments on.",
                    required=True)
     p.add_argument("--clearCache", dest="clearCache", action="store_true",
                    help=f"Clear cache and recompute everything from scratch.")
-    p.set_defaults(clearCache=False)
+    p.add_argument("-importResults", action="append", default=[], metavar="CSV_FILE",
+                   help=f"Import results from a CSV file in the format of {RESULTS_FILE} into the cache "
+                        f"(e.g. cache/Results_OLD.csv), assuming they match the current sources and binaries. "
+                        f"May be given several times.")
+    p.add_argument("-jobs", type=int, default=1,
+                   help=f"Number of synthesis problems to run in parallel. "
+                        f"Each problem gets its own scratch directory in {SCRATCH_DIR}.")
+    p.add_argument("--warm", dest="warm", action="store_true",
+                   help=f"Run Metamorph jobs in long-lived worker processes (one per job slot) instead of "
+                        f"starting a fresh process for every problem.")
+    p.add_argument("--queryCache", dest="queryCache", action="store_true",
+                   help=f"Share the results of Dafny queries between the problems of a benchmark "
+                        f"(stored in {QUERIES_DIR}/BENCHMARK), so that each problem reuses the proofs of the "
+                        f"problems before it. Results obtained this way are cached separately.")
+    p.add_argument("-pretrainJobs", type=int, default=1,
+                   help=f"Number of Dafny queries to run in parallel while pretraining Metamorph on a benchmark. "
+                        f"Pretraining still takes up a single job slot (see -jobs) but uses this many cores. "
+                        f"Pretraining again after editing a benchmark's Definitions.dfy only re-learns the facts "
+                        f"about the methods that changed.")
+    p.add_argument("-searchJobs", type=int, default=1,
+                   help=f"Number of Dafny queries Metamorph runs in parallel while expanding a node of its search. "
+                        f"Each problem still takes up a single job slot (see -jobs) but uses this many cores. "
+                        f"Results obtained with more than one search job are cached separately.")
+    p.add_argument("--seed", dest="seed", action="store_true",
+                   help=f"Seed Metamorph on every problem with the solution it found for the previous (smaller) "
+                        f"problem of the benchmark (stored in {SOLUTIONS_DIR}). The problems of a method then run "
+                        f"one after another. Results obtained this way are cached separately.")
+    p.add_argument("-methods", nargs="+", choices=list(METHOD_NAMES.keys()),
+                   help=f"Only run the given methods (by default, those in the paper's figures). The portfolio runs "
+                        f"the piecewise, greedy, and no distance metric configurations of Metamorph in parallel on "
+                        f"each problem and stops as soon as one of them finds a solution.")
+    p.add_argument("-memoryLimit", type=float, metavar="GIB",
+                   help=f"Memory (in GiB) that a run may use, including all the processes it spawns. A run that uses "
+                        f"more is killed and recorded as {Outcome.MEMOUT}, and the more complex problems of its method "
+                        f"are not run. Memory is measured every 0.1 seconds, so short spikes can get past the "
+                        f"limit. Does not apply to pretraining.")
+    p.add_argument("-memoryBudget", type=float, metavar="GIB",
+                   help=f"Memory (in GiB) that all runs in parallel may use together. A run only starts while the "
+                        f"peak memory recorded for the problems of all running jobs fits into the budget.")
+    p.add_argument("-repeats", type=int, default=1,
+                   help=f"Run every problem this many times, e.g. to compute confidence intervals with regression.py. "
+                        f"The figures only use the first run of each problem.")
+    p.add_argument("--noReport", dest="report", action="store_false",
+                   help=f"Do not produce the figures and tables at the end (run report.py to produce them later).")
+    p.set_defaults(clearCache=False, warm=False, queryCache=False, seed=False, report=True)
     args = p.parse_args(sys.argv[1:])
+    results_cache = open_results_cache()
     if args.clearCache:
+        results_cache.clear()
         with open(RESULTS_FILE, "w") as file:
             file.write(HEADER)
-    if args.benchmark == figure_8_str:
-        benchmark = BENCHMARKS_FIGURE_8
-    elif args.benchmark == figure_10_str:
-        benchmark = BENCHMARKS_FIGURE_10
-    elif args.benchmark == everything_str:
-        benchmark = BENCHMARKS_FIGURE_8 + BENCHMARKS_FIGURE_10 + [EVM_BENCHMARK]
-    else:
-        benchmark = [args.benchmark]
-    main(args.timeLimit, benchmark)
\ No newline at end of file
+        shutil.rmtree(QUERIES_DIR, ignore_errors=True)
+        shutil.rmtree(SOLUTIONS_DIR, ignore_errors=True)
+        # only the artifact directories, the .gitignore in BASELINE_DIR is tracked
+        for entry in os.listdir(BASELINE_DIR):
+            if os.path.isdir(f"{BASELINE_DIR}/{entry}"):
+                shutil.rmtree(f"{BASELINE_DIR}/{entry}")
+    for file in args.importResults:
+        import_results(results_cache, file)
+    benchmark = select_benchmarks(args.benchmark)
+    methods = [METHOD_NAMES[name] for name in args.methods] if args.methods else None
+    memory_limit = int(args.memoryLimit * 2**30) if args.memoryLimit is not None else None
+    memory_budget = int(args.memoryBudget * 2**30) if args.memoryBudget is not None else None
+    main(results_cache, args.timeLimit, benchmark, args.jobs, args.warm, args.queryCache, args.pretrainJobs, methods,
+         args.seed, memory_limit, memory_budget, args.repeats, args.report, args.searchJobs)
\ No newline at end of file
@@ -0,0 +1,158 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+from process_timing import ProcessTreeSampler, Timing, kill_process_group
+
+
+class MetamorphWorker:
+    """A long-lived Metamorph process (started with --server) that runs synthesis jobs one at a time.
+
+    This saves the JIT compilation and assembly loading that a fresh dotnet process pays for on
+    every problem. The process is started lazily and replaced whenever a job times out, is
+    cancelled or crashes, so a job never runs in a process left in an unknown state."""
+
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self._next_id = 0
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            self.command + ["--server"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            start_new_session=True)
+
+    def run(self, args, time_limit=None, stdout=None, on_start=None, memory_limit=None):
+        """Run a job with the given command line arguments, see `process_timing.run_process`.
+
+        CPU time is sampled from /proc at clock-tick resolution and only covers the worker itself
+        and the Z3 processes it waited for; it is None if it cannot be read. Peak RSS covers the
+        worker and everything it spawns, including the memory the worker held before the job."""
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        process = self.process
+        job_id = self._next_id
+        self._next_id += 1
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            kill_process_group(process.pid)
+
+        cpu_time_before = read_cpu_time(process.pid)
+        reset_peak_rss(process.pid)
+        start_time = time.perf_counter()
+        watchdog = None
+        if time_limit is not None:
+            watchdog = threading.Timer(time_limit, on_timeout)
+            watchdog.daemon = True
+            watchdog.start()
+        sampler = ProcessTreeSampler(process.pid, memory_limit)
+        sampler.start()
+        try:
+            if on_start is not None:
+                on_start(process)
+            process.stdin.write(json.dumps({"id": job_id, "args": args}) + "\n")
+            process.stdin.flush()
+            line = process.stdout.readline()
+        except OSError:
+            line = ""  # the worker died before reading the job
+        finally:
+            wall_time = time.perf_counter() - start_time
+            sampler.stop()
+            if watchdog is not None:
+                watchdog.cancel()
+        response = json.loads(line) if line else None
+        memory_exceeded = sampler.memory_exceeded.is_set()
+        if response is None or response["id"] != job_id or timed_out.is_set() or memory_exceeded:
+            # the worker was killed or crashed, so start from a fresh one next time
+            self.close()
+            timing = Timing(wall_time, None, sampler.peak_rss or None, timed_out.is_set(), None, memory_exceeded)
+            output = ""
+        else:
+            cpu_time_after = read_cpu_time(process.pid)
+            cpu_time = None
+            if cpu_time_before is not None and cpu_time_after is not None:
+                cpu_time = cpu_time_after - cpu_time_before
+            # the high-water mark of the worker covers all the jobs it ran, so it is only used without samples
+            peak_rss = sampler.peak_rss or read_peak_rss(process.pid)
+            timing = Timing(wall_time, cpu_time, peak_rss, False, response["exitCode"])
+            output = response["output"]
+        if stdout is not None:
+            with open(stdout, "w") as file:
+                file.write(output)
+        return timing
+
+    def close(self):
+        if self.process is None:
+            return
+        process = self.process
+        self.process = None
+        try:
+            process.stdin.close()  # the server exits once its input is closed
+            process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        kill_process_group(process.pid)
+        process.wait()
+        process.stdout.close()
+
+
+class WorkerPool:
+    """Gives every thread a worker of its own, so that jobs run in parallel never share a process."""
+
+    def __init__(self, command):
+        self.command = command
+        self._workers = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self):
+        worker = getattr(self._local, "worker", None)
+        if worker is None:
+            worker = MetamorphWorker(self.command)
+            self._local.worker = worker
+            with self._lock:
+                self._workers.append(worker)
+        return worker
+
+    def close(self):
+        with self._lock:
+            workers = list(self._workers)
+        for worker in workers:
+            worker.close()
+
+
+def read_cpu_time(pid):
+    # user and system time of the process and of the children it waited for
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return sum(int(field) for field in fields[11:15]) / os.sysconf("SC_CLK_TCK")
+
+
+def reset_peak_rss(pid):
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def read_peak_rss(pid):
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
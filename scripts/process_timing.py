@@ -0,0 +1,158 @@
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+
+import psutil
+
+SAMPLE_INTERVAL = 0.1  # seconds between two measurements of a process tree
+
+
+class Timing:
+    """Resources used by a finished process.
+
+    `cpu_time` (user + system, in seconds) and `peak_rss` (in bytes) cover the process and all
+    its descendants (e.g. the Z3 instances spawned by Dafny), see `ProcessTreeSampler`. `wall_time`
+    is measured with a monotonic high-resolution clock. `memory_exceeded` is set if the process was
+    killed for exceeding its memory limit."""
+
+    def __init__(self, wall_time, cpu_time, peak_rss, timed_out, return_code, memory_exceeded=False):
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.peak_rss = peak_rss
+        self.timed_out = timed_out
+        self.return_code = return_code
+        self.memory_exceeded = memory_exceeded
+
+
+class ProcessTreeSampler:
+    """Measures the resident set size and CPU time of a process tree every SAMPLE_INTERVAL seconds.
+
+    The kernel's accounting only covers descendants that were waited for, and its peak resident set
+    size is that of the largest single process, whereas several Z3 instances may run at once. The
+    sampled peak is the largest total over the tree, and the sampled CPU time adds up the last
+    measurement of every process seen, so both are lower bounds that may miss short-lived spikes or
+    processes. When the tree uses more than `memory_limit` bytes, its process group is killed, so a
+    spike that lasts less than SAMPLE_INTERVAL can get past the limit."""
+
+    def __init__(self, pid, memory_limit=None):
+        self.pid = pid
+        self.memory_limit = memory_limit
+        self.peak_rss = 0
+        self.memory_exceeded = threading.Event()
+        self._cpu_times = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def cpu_time(self):
+        return sum(self._cpu_times.values())
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        try:
+            root = psutil.Process(self.pid)
+        except psutil.NoSuchProcess:
+            return
+        while True:
+            self._sample(root)
+            if self._stopped.wait(SAMPLE_INTERVAL):
+                return
+
+    def _sample(self, root):
+        try:
+            processes = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return  # the root exited
+        rss = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    cpu_times = process.cpu_times()
+                # a pid may be reused once its process is gone
+                self._cpu_times[process.pid, process.create_time()] = cpu_times.user + cpu_times.system
+            except psutil.Error:
+                continue  # the process exited in the meantime
+        self.peak_rss = max(self.peak_rss, rss)
+        if self.memory_limit is not None and rss > self.memory_limit:
+            self.memory_exceeded.set()
+            kill_process_group(self.pid)
+
+
+def kill_process_group(pid):
+    # every process is started in a session of its own, so its pid is also the id of its group
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def unsampled_peak_rss(usage):
+    """The peak memory of a process that exited before it was sampled, or None if it is unknown.
+
+    Linux carries the maximum resident set size across fork and exec, so the one reported for the
+    process is at least that of this process, and only tells something about it if it is larger."""
+    own_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports the maximum resident set size in kilobytes
+    return usage.ru_maxrss * 1024 if usage.ru_maxrss > own_peak else None
+
+
+def run_process(args, time_limit=None, stdout=None, on_start=None, memory_limit=None):
+    """Run `args` (not through a shell) until it exits, `time_limit` seconds have elapsed, or the
+    process and its descendants use more than `memory_limit` bytes of memory.
+
+    On timeout or when exceeding the memory limit, the whole process group is killed, including
+    any grandchildren. `stdout` is a path to redirect the standard output to. `on_start(process)`
+    is called as soon as the process has been started."""
+    output = open(stdout, "w") if stdout is not None else subprocess.DEVNULL
+    try:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(
+            args,
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True)
+    finally:
+        if stdout is not None:
+            output.close()
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        kill_process_group(process.pid)
+
+    watchdog = None
+    if time_limit is not None:
+        watchdog = threading.Timer(max(0, time_limit - (time.perf_counter() - start_time)), on_timeout)
+        watchdog.daemon = True
+        watchdog.start()
+    sampler = ProcessTreeSampler(process.pid, memory_limit)
+    sampler.start()
+    try:
+        if on_start is not None:
+            on_start(process)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start_time
+    finally:
+        sampler.stop()
+        if watchdog is not None:
+            watchdog.cancel()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # a process may exit while leaving orphans behind, which should not outlive it
+    kill_process_group(process.pid)
+    return Timing(wall_time,
+                  max(usage.ru_utime + usage.ru_stime, sampler.cpu_time),
+                  sampler.peak_rss or unsampled_peak_rss(usage),
+                  timed_out.is_set(),
+                  process.returncode,
+                  sampler.memory_exceeded.is_set())
@@ -0,0 +1,294 @@
+import os
+import re
+import sys
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+RECORD_PATTERN = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+) (TRACE|DEBUG|INFO|WARN|ERROR|FATAL) (.*)$')
+VERIFYING_PATTERN = re.compile(r'Verifying the body of the following method(?: \(query (\d+)\))?:')
+FINISHED_PATTERN = re.compile(r'Finished (\w+) query(?: (\d+))? with status (\w+) in (\S+)')
+TIMEOUT_PATTERN = re.compile(r'Encountered a timeout(?: in query (\d+))?$')
+EXPANDING_PATTERN = re.compile(
+    r'Expanding method sequence (.*) -- estimated distance to start = (-?\d+), distance to end = (\d+)')
+POSSIBLE_PATTERN = re.compile(r'The following method sequence is possible \(heuristic=(-?\d+)\): (.*)')
+INITIAL_HEURISTIC_PATTERN = re.compile(r'Initial heuristic value is (-?\d+)')
+SELECTING_PATTERN = re.compile(r'Selecting property (.*) for heuristic analysis')
+TOTAL_PATTERN = re.compile(r'Total time spend on synthesis: (\S+)')
+QUERY_TYPES = ["Regular", "Simplify", "Heuristic"]
+ILP = "IntegerProgramming"
+
+
+def parse_time_string(time_str):
+    """Convert a time string formatted as 'hh:mm:ss.microseconds' to total seconds."""
+    h, m, s = time_str.split(':')
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def problem_name(log_file):
+    """Recover the path of the synthesis problem from the name of its log file."""
+    stage = os.path.basename(log_file).split('_', 2)[-1]
+    return stage.removesuffix('.log').replace('$', '/')
+
+
+def read_records(log_file):
+    """Stream (timestamp, level, message, first continuation line) tuples from a log without loading it into memory."""
+    record = None
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            match = RECORD_PATTERN.match(line)
+            if match is None:
+                if record is not None and record[3] is None:
+                    record = (*record[:3], line.strip())
+                continue
+            if record is not None:
+                yield record
+            timestamp = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S.%f')
+            record = (timestamp, match.group(2), match.group(3), None)
+    if record is not None:
+        yield record
+
+
+class Query:
+    """A single Dafny query reconstructed from the log."""
+
+    def __init__(self, start, query_type, context, depth, label):
+        self.start = start
+        self.query_type = query_type
+        self.context = context
+        self.depth = depth
+        self.label = label
+        self.status = None
+        self.duration = None
+        self.measured = False  # True if the duration was logged by Metamorph rather than estimated from timestamps
+
+
+class Profile:
+    """Everything the profiler extracts from the log of one synthesis problem."""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.problem = problem_name(log_file)
+        self.queries = []
+        self.ilp_durations = []
+        self.timeline = []  # (seconds since start, search depth, heuristic value, event)
+        self.total_time = None
+        self.elapsed = 0.0
+
+
+def profile_log(log_file):
+    """Reconstruct per-query durations, integer programming steps and the search progress from a log.
+
+    Queries are matched by the id Metamorph logs with them, so that the queries of a run with several jobs can overlap.
+    Older logs without query ids are assumed to contain one query at a time."""
+    profile = Profile(log_file)
+    begin = None
+    last = None
+    # for logs without "Finished ... query" lines, the type of a query is inferred from the message preceding it:
+    # the first query after a marker has the marker's type, later ones are made while updating the heuristic
+    marker = ("Heuristic", "initial heuristic analysis")
+    marker_used = False
+    depth = 0
+    pending = {}  # queries whose end has not been seen yet, by query id (None in logs without query ids)
+    timeouts = {}  # estimated end of a pending query, if a timeout was reported
+    ilp_start = None
+
+    def close(query_id, end):
+        query = pending.pop(query_id)
+        query.duration = (end - query.start).total_seconds()
+        profile.queries.append(query)
+        timeouts.pop(query_id, None)
+
+    for timestamp, level, message, detail in read_records(log_file):
+        begin = begin or timestamp
+        last = timestamp
+        if (finished := FINISHED_PATTERN.match(message)) is not None and finished.group(2) in pending:
+            query = pending.pop(finished.group(2))
+            timeouts.pop(finished.group(2), None)
+            query.query_type = finished.group(1)
+            query.status = finished.group(3)
+            query.duration = parse_time_string(finished.group(4))
+            query.measured = True
+            profile.queries.append(query)
+            continue
+        if (timeout := TIMEOUT_PATTERN.match(message)) is not None and timeout.group(1) in pending:
+            pending[timeout.group(1)].status = 'Timeout'
+            timeouts[timeout.group(1)] = timestamp
+            continue
+        # without a query id, a query ends with the next message unless it says how the query ended
+        if None in pending and not message.startswith('Verifying the body of the following method (literal'):
+            close(None, timeouts.get(None) or timestamp)
+        if (verifying := VERIFYING_PATTERN.match(message)) is not None:
+            query_type, context = marker if not marker_used else ("Heuristic", f"heuristic update after {marker[1]}")
+            marker_used = True
+            pending[verifying.group(1)] = Query(timestamp, query_type, context, depth, detail or "")
+        elif message.startswith('Trying method sequence: '):
+            sequence = message[len('Trying method sequence: '):]
+            depth = sequence.count(',') + 1
+            marker, marker_used = ("Regular", sequence), False
+        elif message.startswith('Trying simplification:'):
+            marker, marker_used = ("Simplify", marker[1]), False
+        elif message.startswith('Using integer programming'):
+            ilp_start = timestamp
+        elif message.startswith('The integer programming gives the lower bound') and ilp_start is not None:
+            profile.ilp_durations.append((timestamp - ilp_start).total_seconds())
+            ilp_start = None
+        elif (match := SELECTING_PATTERN.match(message)) is not None:
+            marker, marker_used = ("Heuristic", f"property {match.group(1)}"), False
+        elif (match := EXPANDING_PATTERN.match(message)) is not None:
+            sequence = match.group(1).strip()
+            depth = int(match.group(3))
+            profile.timeline.append(((timestamp - begin).total_seconds(), depth, int(match.group(2)), "expand"))
+            # only a node estimated to be at distance 0 from the start is checked against the constructor
+            marker = ("Regular", f"{sequence or 'goal'} (constructor)") if match.group(2) == '0' else \
+                ("Heuristic", f"heuristic update while expanding {sequence or 'goal'}")
+            marker_used = False
+        elif (match := POSSIBLE_PATTERN.match(message)) is not None:
+            profile.timeline.append(((timestamp - begin).total_seconds(), match.group(2).count(',') + 1,
+                                     int(match.group(1)), "discover"))
+        elif (match := INITIAL_HEURISTIC_PATTERN.match(message)) is not None:
+            profile.timeline.append(((timestamp - begin).total_seconds(), 0, int(match.group(1)), "initial"))
+        elif (match := TOTAL_PATTERN.match(message)) is not None:
+            profile.total_time = parse_time_string(match.group(1))
+    for query_id in list(pending):
+        close(query_id, timeouts.get(query_id) or last)
+    if begin is not None:
+        profile.elapsed = (last - begin).total_seconds()
+    return profile
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(durations):
+    """Count, total, p50, p95 and maximum of a list of durations."""
+    values = sorted(durations)
+    return len(values), sum(values), percentile(values, 0.5), percentile(values, 0.95), values[-1] if values else 0.0
+
+
+def format_report(profiles, top):
+    """Render a plain-text report with latency percentiles per query type and the slowest queries."""
+    lines = []
+    for profile in profiles:
+        # shares are relative to the span covered by the log, which can be shorter than the reported total if
+        # the log was truncated
+        total = profile.elapsed
+        estimated = any(not query.measured for query in profile.queries)
+        lines.append(f"{profile.problem} ({profile.log_file})")
+        depths = [depth for _, depth, _, _ in profile.timeline]
+        heuristics = [heuristic for _, _, heuristic, event in profile.timeline if event != "discover"]
+        lines.append(f"  log spans {total:.3f} s" +
+                     (f" of {profile.total_time:.3f} s" if profile.total_time is not None else "") +
+                     f", {len(profile.queries)} queries, "
+                     f"{sum(1 for *_, event in profile.timeline if event == 'expand')} expansions, "
+                     f"max depth {max(depths, default=0)}" +
+                     (f", heuristic {heuristics[0]} -> {heuristics[-1]}" if heuristics else "") +
+                     (" (query durations estimated from timestamps)" if estimated else ""))
+        lines.append(f"  {'':<20}{'count':>7}{'total s':>11}{'share':>8}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+        by_type = defaultdict(list)
+        for query in profile.queries:
+            by_type[query.query_type].append(query.duration)
+        by_type[ILP] = profile.ilp_durations
+        for query_type in QUERY_TYPES + [ILP]:
+            count, subtotal, p50, p95, maximum = summarize(by_type[query_type])
+            share = 100 * subtotal / total if total else 0.0
+            lines.append(f"  {query_type:<20}{count:>7}{subtotal:>11.3f}{share:>7.1f}%"
+                         f"{p50:>10.3f}{p95:>10.3f}{maximum:>10.3f}")
+        if top > 0 and profile.queries:
+            lines.append(f"  slowest queries:")
+            for query in sorted(profile.queries, key=lambda query: query.duration, reverse=True)[:top]:
+                lines.append(f"    {query.duration:>10.3f} s  {query.query_type:<10} depth {query.depth:<3} "
+                             f"{query.status or '':<15} {query.context}")
+        lines.append("")
+    if len(profiles) > 1:
+        lines.append(f"all {len(profiles)} problems")
+        lines.append(f"  {'':<20}{'count':>7}{'total s':>11}{'p50 s':>10}{'p95 s':>10}{'max s':>10}")
+        by_type = defaultdict(list)
+        for profile in profiles:
+            for query in profile.queries:
+                by_type[query.query_type].append(query.duration)
+            by_type[ILP] += profile.ilp_durations
+        for query_type in QUERY_TYPES + [ILP]:
+            count, subtotal, p50, p95, maximum = summarize(by_type[query_type])
+            lines.append(f"  {query_type:<20}{count:>7}{subtotal:>11.3f}{p50:>10.3f}{p95:>10.3f}{maximum:>10.3f}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def folded_stacks(profiles):
+    """Render the time spent in queries as folded stacks (one 'frame;frame;... milliseconds' line per stack)."""
+    weights = defaultdict(float)
+    for profile in profiles:
+        root = profile.problem.replace(';', ':')
+        accounted = 0.0
+        for query in profile.queries:
+            frames = [root, query.query_type, f"depth {query.depth}", query.context]
+            weights[';'.join(frame.replace(';', ':') for frame in frames)] += query.duration
+            accounted += query.duration
+        ilp_time = sum(profile.ilp_durations)
+        if ilp_time:
+            weights[f"{root};{ILP}"] += ilp_time
+            accounted += ilp_time
+        other = profile.elapsed - accounted
+        if other > 0:
+            weights[f"{root};Other"] += other
+    return "".join(f"{stack} {round(weight * 1000)}\n" for stack, weight in sorted(weights.items()) if weight > 0)
+
+
+def write_timeline(profile, timeline_dir):
+    """Save how the search depth and heuristic value change over time as a CSV file."""
+    os.makedirs(timeline_dir, exist_ok=True)
+    file_name = os.path.basename(profile.log_file).removesuffix('.log') + '.csv'
+    with open(os.path.join(timeline_dir, file_name), 'w') as f:
+        f.write("Seconds,Depth,Heuristic,Event\n")
+        for seconds, depth, heuristic, event in profile.timeline:
+            f.write(f"{seconds},{depth},{heuristic},{event}\n")
+
+
+def find_log_files(paths):
+    """Expand directories into the synthesis problem logs they contain."""
+    log_files = []
+    for path in paths:
+        if os.path.isfile(path):
+            log_files.append(path)
+            continue
+        for directory, _, files in os.walk(path):
+            log_files += [os.path.join(directory, f) for f in files
+                          if f.endswith('.log') and 'StartUp' not in f and 'Definitions' not in f]
+    return sorted(log_files)
+
+
+def main(paths, top, folded_file, timeline_dir):
+    profiles = []
+    for log_file in find_log_files(paths):
+        profile = profile_log(log_file)
+        profiles.append(profile)
+        if timeline_dir:
+            write_timeline(profile, timeline_dir)
+    print(format_report(profiles, top))
+    if folded_file:
+        with open(folded_file, 'w') as f:
+            f.write(folded_stacks(profiles))
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(
+        description="Profile the Dafny queries Metamorph makes, based on its (TRACE level) logs.")
+    p.add_argument('-logs', nargs='+',
+                   help=f"Log files or directories with logs.",
+                   required=True)
+    p.add_argument('-top', type=int, default=10,
+                   help=f"Number of slowest queries to list for each problem.")
+    p.add_argument('-folded',
+                   help=f"Write the time spent per query type, search depth and context as folded stacks to this file "
+                        f"(e.g. for flamegraph.pl or speedscope).")
+    p.add_argument('-timeline',
+                   help=f"Directory in which to write, for each log, a CSV file with the search depth and "
+                        f"heuristic value over time.")
+    args = p.parse_args(sys.argv[1:])
+    main(args.logs, args.top, args.folded, args.timeline)
@@ -0,0 +1,237 @@
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+from evaluate import BENCHMARKS_FIGURE_8, BENCHMARKS_FIGURE_10, EVM_BENCHMARK, METHOD_NAMES, Method, \
+    benchmark_methods, open_results_cache, problem_index, problem_size, result_fingerprint
+from results_cache import Outcome
+
+DEFAULT_REFERENCE = "cache/Results_OLD.csv"
+DEFAULT_REPORT = "Regression.json"
+# two-sided 97.5% quantiles of Student's t-distribution by degrees of freedom, for 95% confidence intervals
+T_QUANTILES = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+               2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+               2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+NORMAL_QUANTILE = 1.960
+
+
+def t_quantile(degrees_of_freedom):
+    return T_QUANTILES[degrees_of_freedom - 1] if degrees_of_freedom <= len(T_QUANTILES) else NORMAL_QUANTILE
+
+
+class Runs:
+    """All runs of one method on one problem."""
+
+    def __init__(self):
+        self.outcomes = []
+        self.times = []  # running times of the successful runs
+
+    def add(self, outcome, running_time):
+        self.outcomes.append(outcome)
+        if outcome == Outcome.SUCCESS:
+            self.times.append(running_time)
+
+    @property
+    def solved(self):
+        return len(self.outcomes) > 0 and all(outcome == Outcome.SUCCESS for outcome in self.outcomes)
+
+    def mean(self):
+        return float(np.mean(self.times))
+
+    def confidence_interval(self):
+        """95% confidence interval for the mean running time, or None with fewer than two runs."""
+        if len(self.times) < 2:
+            return None
+        half_width = t_quantile(len(self.times) - 1) * np.std(self.times, ddof=1) / np.sqrt(len(self.times))
+        return [self.mean() - half_width, self.mean() + half_width]
+
+    def describe(self):
+        return {"runs": len(self.outcomes), "solved": self.solved,
+                "mean": self.mean() if self.solved else None,
+                "confidenceInterval": self.confidence_interval() if self.solved else None}
+
+
+def infer_run(limit, outcome, running_time, time_limit):
+    """The outcome and running time of a run with the given limit had it been run with `time_limit` instead, or None
+    if that is not known (following the rules of ResultsCache.infer)."""
+    if limit == time_limit or (outcome != Outcome.TIMEOUT and running_time <= time_limit):
+        return outcome, running_time
+    if outcome != Outcome.TIMEOUT or limit >= time_limit:
+        return Outcome.TIMEOUT, time_limit
+    return None
+
+
+def read_reference(file, time_limit):
+    """The runs stored in a CSV file in the format of cache/Results.csv, by benchmark, method and problem.
+
+    Several rows for the same problem and time limit (e.g. from evaluate.py with -repeats) are several runs. Such a
+    file collects the results of every time limit it was evaluated with, so only the runs with `time_limit` are used,
+    or, if there are none, those with the closest time limit from which the outcome with `time_limit` follows."""
+    rows = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    with open(file) as f:
+        for line in f.readlines()[1:]:
+            benchmark, limit, method, problem, outcome, running_time = line.strip().split(",")
+            if int(limit) < 0:
+                continue  # pretraining
+            rows[benchmark, method][problem][int(limit)].append((outcome, float(running_time)))
+    reference = defaultdict(lambda: defaultdict(Runs))
+    for key, problems in rows.items():
+        for problem, limits in problems.items():
+            for limit in sorted(limits, key=lambda limit: abs(limit - time_limit)):
+                runs = [infer_run(limit, outcome, running_time, time_limit) for outcome, running_time in limits[limit]]
+                if None not in runs:
+                    for outcome, running_time in runs:
+                        reference[key][problem].add(outcome, running_time)
+                    break
+    return reference
+
+
+def read_current(results_cache, benchmark, method, time_limit, query_cache, seed, search_jobs=1):
+    """The runs of the current sources and binaries, including all repetitions."""
+    current = defaultdict(Runs)
+    for line in problem_index(benchmark)[1:]:
+        problem = line[1]
+        repeat = 0
+        while True:
+            result = results_cache.infer(benchmark, time_limit, method, problem,
+                                         result_fingerprint(benchmark, method, problem, query_cache,
+                                                            seed=seed and method != Method.BASELINE, repeat=repeat,
+                                                            search_jobs=search_jobs))
+            if result is None:
+                break
+            current[problem].add(result.outcome, result.running_time)
+            repeat += 1
+    return current
+
+
+def fit_scaling(runs):
+    """Fit running time = a * size^exponent by least squares on a log-log scale.
+
+    Returns the exponent and its standard error, or None with fewer than two problems. The standard error is None
+    with fewer than three problems."""
+    points = [(problem_size(problem), problem_runs.mean()) for problem, problem_runs in runs.items()]
+    points = [(size, time) for size, time in points if size is not None and size > 0 and time > 0]
+    if len(points) < 2:
+        return None
+    x = np.log([size for size, _ in points])
+    y = np.log([time for _, time in points])
+    exponent, intercept = np.polyfit(x, y, 1)
+    stderr = None
+    if len(points) > 2:
+        residuals = y - (exponent * x + intercept)
+        stderr = float(np.sqrt(np.sum(residuals ** 2) / (len(points) - 2) / np.sum((x - np.mean(x)) ** 2)))
+    return {"exponent": float(exponent), "stderr": stderr, "problems": len(points)}
+
+
+def compare(current, reference, time_limit, tolerance, exponent_tolerance):
+    """Compare the runs of one method on one benchmark with the reference runs.
+
+    The method regressed if it no longer solves a problem the reference solved within the time limit, if its
+    running times are measurably slower (the geometric mean slowdown over the problems both solve exceeds the
+    tolerance and its confidence interval excludes 1), or if its running time grows measurably faster with the
+    size of the problem."""
+    failures = []
+    unsolved = sorted(problem for problem, runs in reference.items()
+                      if runs.solved and runs.mean() <= time_limit and not current[problem].solved)
+    if unsolved:
+        failures.append(f"no longer solves {', '.join(unsolved)}")
+    common = sorted(problem for problem, runs in reference.items() if runs.solved and current[problem].solved)
+    report = {
+        "problems": {problem: {**current[problem].describe(), "reference": reference[problem].describe()}
+                     for problem in sorted(set(current) | set(reference))},
+        "unsolved": unsolved,
+        "slowdown": None,
+        "scaling": None,
+    }
+    if common:
+        log_ratios = np.log([current[problem].mean() / reference[problem].mean() for problem in common])
+        slowdown = {"ratio": float(np.exp(np.mean(log_ratios))), "confidenceInterval": None, "problems": len(common)}
+        if len(common) > 1:
+            half_width = t_quantile(len(common) - 1) * np.std(log_ratios, ddof=1) / np.sqrt(len(common))
+            slowdown["confidenceInterval"] = [float(np.exp(np.mean(log_ratios) - half_width)),
+                                              float(np.exp(np.mean(log_ratios) + half_width))]
+        report["slowdown"] = slowdown
+        interval = slowdown["confidenceInterval"]
+        if slowdown["ratio"] > 1 + tolerance and (interval is None or interval[0] > 1):
+            failures.append(f"is {slowdown['ratio']:.2f} times slower")
+    # both curves are fit on the same problems, since the largest problems dominate the exponent
+    scaling = fit_scaling({problem: current[problem] for problem in common})
+    reference_scaling = fit_scaling({problem: reference[problem] for problem in common})
+    if scaling is not None and reference_scaling is not None:
+        report["scaling"] = {"current": scaling, "reference": reference_scaling}
+        difference = scaling["exponent"] - reference_scaling["exponent"]
+        errors = [fit["stderr"] for fit in [scaling, reference_scaling] if fit["stderr"] is not None]
+        significance = NORMAL_QUANTILE * np.sqrt(sum(error ** 2 for error in errors))
+        if difference > exponent_tolerance and difference > significance:
+            failures.append(f"scales worse (exponent {scaling['exponent']:.2f} instead of "
+                            f"{reference_scaling['exponent']:.2f})")
+    report["failures"] = failures
+    report["passed"] = not failures
+    return report
+
+
+def main(time_limit, benchmarks, methods, reference_file, report_file, tolerance, exponent_tolerance,
+         query_cache=False, seed=False, search_jobs=1):
+    reference = read_reference(reference_file, time_limit)
+    results_cache = open_results_cache()
+    comparisons = []
+    for benchmark in benchmarks:
+        for method in benchmark_methods(benchmark, methods):
+            current = read_current(results_cache, benchmark, method, time_limit, query_cache, seed, search_jobs)
+            if not current:
+                continue
+            if (benchmark, method) not in reference:
+                print(f"No reference results for {method} on {benchmark}.")
+                continue
+            comparison = compare(current, reference[benchmark, method], time_limit, tolerance, exponent_tolerance)
+            comparisons.append({"benchmark": benchmark, "method": method, **comparison})
+            status = "passed" if comparison["passed"] else f"REGRESSED, {'; '.join(comparison['failures'])}"
+            slowdown = comparison["slowdown"]
+            ratio = f" (running times {slowdown['ratio']:.2f}x the reference)" if slowdown is not None else ""
+            print(f"{benchmark}, {method}{ratio}: {status}")
+    passed = all(comparison["passed"] for comparison in comparisons)
+    with open(report_file, "w") as file:
+        json.dump({"timeLimit": time_limit, "reference": reference_file, "tolerance": tolerance,
+                   "exponentTolerance": exponent_tolerance, "passed": passed, "comparisons": comparisons},
+                  file, indent=2)
+    print(f"Compared {len(comparisons)} benchmark and method pairs with {reference_file}, "
+          f"{'no regressions' if passed else 'found regressions'} (see {report_file}).")
+    return passed
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(
+        description="Compare the results of evaluate.py for the current build of Metamorph with reference results "
+                    "and exit with a nonzero status if the current build is measurably slower or scales worse.")
+    p.add_argument("-timeLimit", type=int,
+                   help=f"The time limit evaluate.py was run with.",
+                   required=True)
+    all_benchmarks = BENCHMARKS_FIGURE_8 + BENCHMARKS_FIGURE_10 + [EVM_BENCHMARK]
+    p.add_argument("-benchmarks", nargs="+", choices=all_benchmarks, default=all_benchmarks,
+                   help=f"The benchmarks to compare (by default, all those with results).")
+    p.add_argument("-methods", nargs="+", choices=list(METHOD_NAMES.keys()),
+                   help=f"Only compare the given methods (by default, those in the paper's figures).")
+    p.add_argument("-reference", default=DEFAULT_REFERENCE,
+                   help=f"CSV file with the reference results, in the format of cache/Results.csv "
+                        f"(default: {DEFAULT_REFERENCE}).")
+    p.add_argument("-report", default=DEFAULT_REPORT,
+                   help=f"JSON file to write the comparison to (default: {DEFAULT_REPORT}).")
+    p.add_argument("-tolerance", type=float, default=0.1,
+                   help=f"Slowdown that is tolerated, as a fraction of the reference running times (default: 0.1).")
+    p.add_argument("-exponentTolerance", type=float, default=0.1,
+                   help=f"Increase of the exponent of the fitted power law (running time as a function of the size "
+                        f"of the problem) that is tolerated (default: 0.1).")
+    p.add_argument("--queryCache", dest="queryCache", action="store_true",
+                   help=f"Compare the results obtained with evaluate.py --queryCache.")
+    p.add_argument("--seed", dest="seed", action="store_true",
+                   help=f"Compare the results obtained with evaluate.py --seed.")
+    p.add_argument("-searchJobs", type=int, default=1,
+                   help=f"Compare the results obtained with evaluate.py -searchJobs.")
+    p.set_defaults(queryCache=False, seed=False)
+    args = p.parse_args(sys.argv[1:])
+    methods = [METHOD_NAMES[name] for name in args.methods] if args.methods else None
+    sys.exit(0 if main(args.timeLimit, args.benchmarks, methods, args.reference, args.report, args.tolerance,
+                       args.exponentTolerance, args.queryCache, args.seed, args.searchJobs) else 1)
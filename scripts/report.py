@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from evaluate import BENCHMARK_CHOICES, DEFAULT_TIME_LIMIT, EVM_BENCHMARK, METHOD_NAMES, Method, benchmark_methods, \
+    open_results_cache, problem_index, problem_size, result_fingerprint, select_benchmarks
+from results_cache import Outcome, file_digest, fingerprint
+
+MANIFEST_FILE = "cache/ReportManifest.json"
+TABLE_1_FILE = "Table1.csv"
+FIGURE_9_FILE = "Figure9.pdf"
+LINE_STYLES = ["-", "--", "-.", ":", (0, (5, 1, 1, 1, 1, 1))]
+
+
+class Results:
+    """The results of the current sources and binaries, loaded once and stored column by column."""
+
+    def __init__(self, rows):
+        benchmarks, methods, problems, outcomes, running_times = zip(*rows) if rows else ([],) * 5
+        self.benchmark = np.array(benchmarks, dtype=object)
+        self.method = np.array(methods, dtype=object)
+        self.problem = np.array(problems, dtype=object)
+        self.size = np.array([-1 if problem_size(problem) is None else problem_size(problem) for problem in problems],
+                             dtype=int)
+        self.outcome = np.array(outcomes, dtype=object)
+        self.running_time = np.array(running_times, dtype=float)
+
+    def select(self, benchmark, method=None):
+        """Indices of the results of a benchmark (and method), in the order of the benchmark's problems."""
+        mask = self.benchmark == benchmark
+        if method is not None:
+            mask &= self.method == method
+        return np.flatnonzero(mask)
+
+    def methods(self, benchmark):
+        return list(dict.fromkeys(self.method[self.select(benchmark)]))
+
+    def digest(self, indices):
+        return fingerprint(*(f"{self.method[i]}:{self.problem[i]}:{self.outcome[i]}:{self.running_time[i]!r}"
+                             for i in indices))
+
+
+def load_results(results_cache, benchmarks, time_limit, methods=None, query_cache=False, seed=False, search_jobs=1):
+    # only results that match the current sources and binaries are reported
+    rows = []
+    for benchmark in benchmarks:
+        for method in benchmark_methods(benchmark, methods):
+            for line in problem_index(benchmark)[1:]:
+                problem = line[1]
+                result = results_cache.infer(benchmark, time_limit, method, problem,
+                                             result_fingerprint(benchmark, method, problem, query_cache,
+                                                                seed=seed and method != Method.BASELINE,
+                                                                search_jobs=search_jobs))
+                if result is not None:
+                    rows.append((benchmark, method, problem, result.outcome, result.running_time))
+    return Results(rows)
+
+
+def pyplot():
+    """Import matplotlib, which is only needed (and slow to import) when a figure has to be drawn."""
+    import matplotlib
+    # Use Type-1 fonts instead of Type-3
+    matplotlib.rcParams['pdf.fonttype'] = 42  # Ensures TrueType fonts are used in PDFs
+    matplotlib.rcParams['ps.fonttype'] = 42   # Ensures TrueType fonts are used in PS
+
+    # Set a font that works well
+    matplotlib.rcParams['font.family'] = 'serif'  # Or 'Times New Roman' for IEEE submissions
+    matplotlib.rcParams['text.usetex'] = False    # Disable LaTeX rendering to avoid unexpected Type-3 fonts
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def write_table_1(results, time_limit):
+    indices = results.select(EVM_BENCHMARK)
+    methods = results.methods(EVM_BENCHMARK)
+    times = {(results.method[i], results.problem[i]): results.running_time[i] for i in indices}
+    problems = [results.problem[i] for i in results.select(EVM_BENCHMARK, methods[0])] if methods else []
+    with open(TABLE_1_FILE, "w") as file:
+        file.write(f"Problem,{','.join(methods)}\n")
+        for problem in problems:
+            row = [str(times[method, problem]) if (method, problem) in times else "" for method in methods]
+            file.write(f"{problem},{','.join(row)}\n")
+
+
+def plot_figure(results, benchmark, time_limit):
+    plt = pyplot()
+    fig, ax = plt.subplots(layout='constrained')
+    for id, method in enumerate(results.methods(benchmark)):
+        indices = results.select(benchmark, method)
+        # failed runs have no meaningful running time, and timeouts show up at the time limit
+        indices = indices[(results.size[indices] >= 0) &
+                          ~np.isin(results.outcome[indices], [Outcome.FAILED, Outcome.MEMOUT])]
+        indices = indices[np.argsort(results.size[indices], kind="stable")]
+        plt.plot(results.size[indices], results.running_time[indices] / 60,
+                 label=method, linestyle=LINE_STYLES[id % len(LINE_STYLES)], linewidth=6)
+    plt.plot(np.arange(20), [time_limit/60] * 20,
+             linestyle="--", color="red", linewidth=6)
+    ax.annotate("Timeout", xy=(17, 150), xytext=(
+        17, 150), color="red", fontsize=36)
+
+    if benchmark == "BinaryTree":
+        plt.legend(loc='center right', fontsize=50, bbox_to_anchor=(1, 0.6))
+    else:
+        plt.legend(loc='lower right', fontsize=50)
+    ax.set_ylabel('Running time (min)', fontsize=50)
+    ax.set_xlabel('Object size', fontsize=50)
+    ax.tick_params(axis='x', labelsize=36)
+    ax.tick_params(axis='y', labelsize=36)
+    fig.set_size_inches(24, 16)
+    ax.set_yscale('log')
+    ax.set_xticks(range(0, 20))
+    # line below makes it easier to compare results compiled with different time limits
+    ax.set_ylim(1/60, DEFAULT_TIME_LIMIT)
+    plt.savefig(f'{benchmark}.pdf')
+    plt.close(fig)
+
+
+def plot_figure_9(log_dir):
+    import running_time_analysis
+    running_time_analysis.main(log_dir)
+
+
+def logs_digest(log_dir):
+    entries = []
+    for directory, _, files in os.walk(log_dir):
+        for name in files:
+            stat = os.stat(os.path.join(directory, name))
+            entries.append(f"{os.path.join(directory, name)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return fingerprint(*sorted(entries))
+
+
+class Manifest:
+    """Remembers a digest of the inputs of every output, so that outputs are only rebuilt when their inputs change.
+
+    The digests include this script, so that outputs are also rebuilt after changing how they are drawn."""
+
+    def __init__(self, path, force=False):
+        self.path = path
+        self.entries = {}
+        if not force:
+            try:
+                with open(path) as file:
+                    self.entries = json.load(file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+    def build(self, output, digest, build):
+        digest = fingerprint(file_digest(os.path.abspath(__file__)), digest)
+        if self.entries.get(output) == digest and os.path.exists(output):
+            print(f"{output} is up to date.")
+            return
+        build()
+        self.entries[output] = digest
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.tmp", "w") as file:
+            json.dump(self.entries, file, indent=2)
+        os.replace(f"{self.path}.tmp", self.path)
+        print(f"Wrote {output}.")
+
+
+def main(time_limit, benchmarks, methods=None, query_cache=False, seed=False, log_dir=None, force=False,
+         search_jobs=1):
+    results_cache = open_results_cache()
+    results = load_results(results_cache, benchmarks, time_limit, methods, query_cache, seed, search_jobs)
+    manifest = Manifest(MANIFEST_FILE, force)
+    for benchmark in benchmarks:
+        digest = fingerprint(time_limit, results.digest(results.select(benchmark)))
+        if benchmark == EVM_BENCHMARK:
+            manifest.build(TABLE_1_FILE, digest, lambda: write_table_1(results, time_limit))
+        else:
+            manifest.build(f"{benchmark}.pdf", digest, lambda: plot_figure(results, benchmark, time_limit))
+    if log_dir is not None:
+        manifest.build(FIGURE_9_FILE, fingerprint(os.path.abspath(log_dir), logs_digest(log_dir)),
+                       lambda: plot_figure_9(log_dir))
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(
+        description="Produce the figures and tables of the paper from the results of evaluate.py, rebuilding only "
+                    "those whose results changed. Can be run while evaluate.py is still running.")
+    p.add_argument("-timeLimit", type=int,
+                   help=f"The time limit evaluate.py was run with.",
+                   required=True)
+    p.add_argument("-benchmarks", nargs="+", choices=BENCHMARK_CHOICES,
+                   help=f"The benchmarks (or groups of benchmarks) to produce the figures for. "
+                        f"EVM produces {TABLE_1_FILE}, every other benchmark a PDF file named after it.",
+                   required=True)
+    p.add_argument("-methods", nargs="+", choices=list(METHOD_NAMES.keys()),
+                   help=f"Only show the given methods (by default, those in the paper's figures).")
+    p.add_argument("--queryCache", dest="queryCache", action="store_true",
+                   help=f"Show the results obtained with evaluate.py --queryCache.")
+    p.add_argument("--seed", dest="seed", action="store_true",
+                   help=f"Show the results obtained with evaluate.py --seed.")
+    p.add_argument("-searchJobs", type=int, default=1,
+                   help=f"Show the results obtained with evaluate.py -searchJobs.")
+    p.add_argument("-logs",
+                   help=f"Also produce {FIGURE_9_FILE} from the logs in this directory (see running_time_analysis.py).")
+    p.add_argument("--force", dest="force", action="store_true",
+                   help=f"Rebuild everything, even outputs whose inputs did not change (see {MANIFEST_FILE}).")
+    p.set_defaults(queryCache=False, seed=False, force=False)
+    args = p.parse_args(sys.argv[1:])
+    methods = [METHOD_NAMES[name] for name in args.methods] if args.methods else None
+    benchmarks = list(dict.fromkeys(benchmark for choice in args.benchmarks for benchmark in select_benchmarks(choice)))
+    main(args.timeLimit, benchmarks, methods, args.queryCache, args.seed, args.logs, args.force, args.searchJobs)
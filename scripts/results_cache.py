@@ -0,0 +1,177 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+
+INCLUDE_PATTERN = re.compile(r'^\s*include\s+"([^"]+)"', re.MULTILINE)
+
+
+class Outcome:
+    SUCCESS = "SUCCESS"
+    TIMEOUT = "TIMEOUT"
+    FAILED = "FAILED"
+    MEMOUT = "MEMOUT"  # killed for exceeding the memory limit
+
+
+class Result:
+
+    def __init__(self, outcome, running_time, cpu_time=None, peak_rss=None, inferred_from=None, strategy=None):
+        self.outcome = outcome
+        self.running_time = running_time
+        self.cpu_time = cpu_time
+        self.peak_rss = peak_rss
+        self.inferred_from = inferred_from  # the time limit of the run this result was inferred from
+        self.strategy = strategy  # the strategy that won, for a portfolio run
+
+    def describe(self):
+        description = f"{self.running_time:.3f} seconds"
+        if self.cpu_time is not None:
+            description += f", CPU time {self.cpu_time:.3f} seconds"
+        if self.peak_rss is not None:
+            description += f", peak RSS {self.peak_rss / 2**20:.1f} MiB"
+        if self.strategy is not None:
+            description += f", won by the {self.strategy} strategy"
+        return description
+
+
+class ResultsCache:
+    """Results of previous runs, stored in an SQLite database that several runs can share.
+
+    Every result is keyed by benchmark, time limit, method, problem, and a fingerprint of
+    everything the result depends on (see `fingerprint`). When any of these inputs changes,
+    the affected results simply stop matching, while all other results remain usable."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "benchmark TEXT NOT NULL, time_limit INTEGER NOT NULL, method TEXT NOT NULL, problem TEXT NOT NULL, "
+            "fingerprint TEXT NOT NULL, outcome TEXT NOT NULL, running_time REAL NOT NULL, "
+            "cpu_time REAL, peak_rss INTEGER, strategy TEXT, "
+            "PRIMARY KEY (benchmark, time_limit, method, problem, fingerprint))")
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(results)")]
+        if "strategy" not in columns:
+            # databases created before portfolio runs existed
+            self._connection.execute("ALTER TABLE results ADD COLUMN strategy TEXT")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_by_problem ON results (benchmark, method, problem, fingerprint)")
+
+    def lookup(self, benchmark, time_limit, method, problem, fingerprint):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT outcome, running_time, cpu_time, peak_rss, strategy FROM results "
+                "WHERE benchmark = ? AND time_limit = ? AND method = ? AND problem = ? AND fingerprint = ?",
+                (benchmark, time_limit, method, problem, fingerprint)).fetchone()
+        if row is None:
+            return None
+        outcome, running_time, cpu_time, peak_rss, strategy = row
+        return Result(outcome, running_time, cpu_time, peak_rss, strategy=strategy)
+
+    def infer(self, benchmark, time_limit, method, problem, fingerprint):
+        """Like `lookup`, but also answers from runs with other time limits where that is sound.
+
+        A run that succeeded or failed after t seconds has the same outcome with any time limit
+        of at least t, and would have timed out with any smaller limit. A run that timed out
+        with limit L would also time out with any limit of at most L."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT time_limit, outcome, running_time, cpu_time, peak_rss, strategy FROM results "
+                "WHERE benchmark = ? AND method = ? AND problem = ? AND fingerprint = ? AND time_limit >= 0",
+                (benchmark, method, problem, fingerprint)).fetchall()
+        timeout = None
+        # prefer the exact time limit, then the closest one
+        rows = sorted(rows, key=lambda row: abs(row[0] - time_limit))
+        for limit, outcome, running_time, cpu_time, peak_rss, strategy in rows:
+            if limit == time_limit:
+                return Result(outcome, running_time, cpu_time, peak_rss, strategy=strategy)
+            if outcome != Outcome.TIMEOUT and running_time <= time_limit:
+                return Result(outcome, running_time, cpu_time, peak_rss, limit, strategy)
+            if timeout is None and (outcome != Outcome.TIMEOUT or limit >= time_limit):
+                timeout = Result(Outcome.TIMEOUT, time_limit, inferred_from=limit)
+        return timeout
+
+    def peak_rss(self, benchmark, method, problem):
+        """The largest peak RSS recorded for a problem with any time limit and version, or None if unknown."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT MAX(peak_rss) FROM results WHERE benchmark = ? AND method = ? AND problem = ?",
+                (benchmark, method, problem)).fetchone()
+        return row[0]
+
+    def store(self, benchmark, time_limit, method, problem, fingerprint, result):
+        self.store_all([(benchmark, time_limit, method, problem, fingerprint, result)])
+
+    def store_all(self, entries):
+        rows = [(benchmark, time_limit, method, problem, fingerprint,
+                 result.outcome, result.running_time, result.cpu_time, result.peak_rss, result.strategy)
+                for benchmark, time_limit, method, problem, fingerprint, result in entries]
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO results (benchmark, time_limit, method, problem, fingerprint, "
+                    "outcome, running_time, cpu_time, peak_rss, strategy) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM results")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def fingerprint(*parts):
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def file_digest(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return "missing"
+    return _file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=None)
+def _file_digest(path, size, mtime):
+    # size and modification time are only part of the key, so that edits made while running are noticed
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_digest(path):
+    """Digest of a Dafny file together with all the files it includes, directly or indirectly."""
+    pending = [os.path.normpath(path)]
+    files = set()
+    while pending:
+        current = pending.pop()
+        if current in files:
+            continue
+        files.add(current)
+        try:
+            with open(current) as file:
+                includes = INCLUDE_PATTERN.findall(file.read())
+        except FileNotFoundError:
+            continue
+        pending += [os.path.normpath(os.path.join(os.path.dirname(current), include)) for include in includes]
+    return fingerprint(*(f"{file}:{file_digest(file)}" for file in sorted(files)))
+
+
+def directory_digest(directory, extension=".dll"):
+    """Digest of all files with the given extension in a directory, e.g. the assemblies of a tool."""
+    if not os.path.isdir(directory):
+        return "missing"
+    files = sorted(entry.name for entry in os.scandir(directory) if entry.name.endswith(extension))
+    return fingerprint(*(f"{file}:{file_digest(os.path.join(directory, file))}" for file in files))
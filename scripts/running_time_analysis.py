@@ -1,4 +1,4 @@
-import glob
+import json
 import os
 import re
 import numpy as np
@@ -7,6 +7,8 @@ import matplotlib
 from collections import defaultdict
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from telemetry import EVENTS_EXTENSION, read_summary
 
 # Use Type-1 fonts instead of Type-3
 matplotlib.rcParams['pdf.fonttype'] = 42  # Ensures TrueType fonts are used in PDFs
@@ -16,6 +18,11 @@ matplotlib.rcParams['ps.fonttype'] = 42   # Ensures TrueType fonts are used in P
 matplotlib.rcParams['font.family'] = 'serif'  # Or 'Times New Roman' for IEEE submissions
 matplotlib.rcParams['text.usetex'] = False    # Disable LaTeX rendering to avoid unexpected Type-3 fonts
 
+DEFAULT_INDEX_FILE = "cache/LogIndex.json"
+# These are not log files with regular synthesis problems,
+# and we don't want the first two (one? three?) problems, since they are simple and disproportionally affect everything
+EXCLUDED_LOGS = ["Definitions", "StartUp", "Problem00", "Problem01"]
+
 
 def parse_time_string(time_str):
     """Convert a time string formatted as 'hh:mm:ss.microseconds' to total seconds."""
@@ -32,7 +39,7 @@ def extract_benchmark_name(filename):
         # The third part is the path with '$' as separator
         path_with_dollar = parts[2]
         # Remove the file extension
-        path_with_dollar = path_with_dollar.replace('.dfy.log', '')
+        path_with_dollar = path_with_dollar.replace('.dfy.log', '').replace('.dfy' + EVENTS_EXTENSION, '')
         # Split the path into parts
         path_parts = path_with_dollar.split('$')
         try:
@@ -43,70 +50,155 @@ def extract_benchmark_name(filename):
             pass
     return None
 
+def read_last_lines(file_path, count, block_size=1 << 16):
+    """Read the last `count` lines of a file without reading the rest of it."""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b''
+        # one more line than requested, so that the first line is complete
+        while position > 0 and tail.count(b'\n') <= count:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+    return tail.decode('utf-8', errors='replace').splitlines()[-count:]
+
 def extract_times_from_log(file_path):
     """Extract time data from a log file and compute percentages."""
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-        # Get the last 10 lines to find the time breakdown
-        last_lines = lines[-10:]
-        
-        total_time = -1
-        regular_time = -1
-        simplify_time = -1
-        heuristic_time = -1
-        
-        for line in last_lines:
-            line = line.strip()
-            if 'Total time spend on synthesis:' in line:
-                match = re.search(r'Total time spend on synthesis: (.+)', line)
-                if match:
-                    time_str = match.group(1)
-                    total_time = parse_time_string(time_str)
-            elif 'Total number of Regular queries to Dafny:' in line:
-                match = re.search(r'Total number of Regular queries to Dafny: \d+ \((.+)\)', line)
-                if match:
-                    time_str = match.group(1)
-                    regular_time = parse_time_string(time_str)
-            elif 'Total number of Simplify queries to Dafny:' in line:
-                match = re.search(r'Total number of Simplify queries to Dafny: \d+ \((.+)\)', line)
-                if match:
-                    time_str = match.group(1)
-                    simplify_time = parse_time_string(time_str)
-            elif 'Total number of Heuristic queries to Dafny:' in line:
-                match = re.search(r'Total number of Heuristic queries to Dafny: \d+ \((.+)\)', line)
-                if match:
-                    time_str = match.group(1)
-                    heuristic_time = parse_time_string(time_str)
-                    
-        if total_time != -1 and regular_time != -1 and simplify_time != -1 and heuristic_time != -1:
-            other_time = total_time - (regular_time + simplify_time + heuristic_time)
-            # Convert to percentages
-            regular_pct = (regular_time / total_time) * 100
-            simplify_pct = (simplify_time / total_time) * 100
-            heuristic_pct = (heuristic_time / total_time) * 100
-            other_pct = (other_time / total_time) * 100
-            return regular_pct, simplify_pct, heuristic_pct, other_pct
+    # Get the last 10 lines to find the time breakdown
+    last_lines = read_last_lines(file_path, 10)
+    
+    total_time = -1
+    regular_time = -1
+    simplify_time = -1
+    heuristic_time = -1
+    
+    for line in last_lines:
+        line = line.strip()
+        if 'Total time spend on synthesis:' in line:
+            match = re.search(r'Total time spend on synthesis: (.+)', line)
+            if match:
+                time_str = match.group(1)
+                total_time = parse_time_string(time_str)
+        elif 'Total number of Regular queries to Dafny:' in line:
+            match = re.search(r'Total number of Regular queries to Dafny: \d+ \((.+)\)', line)
+            if match:
+                time_str = match.group(1)
+                regular_time = parse_time_string(time_str)
+        elif 'Total number of Simplify queries to Dafny:' in line:
+            match = re.search(r'Total number of Simplify queries to Dafny: \d+ \((.+)\)', line)
+            if match:
+                time_str = match.group(1)
+                simplify_time = parse_time_string(time_str)
+        elif 'Total number of Heuristic queries to Dafny:' in line:
+            match = re.search(r'Total number of Heuristic queries to Dafny: \d+ \((.+)\)', line)
+            if match:
+                time_str = match.group(1)
+                heuristic_time = parse_time_string(time_str)
+                
+    if total_time != -1 and regular_time != -1 and simplify_time != -1 and heuristic_time != -1:
+        other_time = total_time - (regular_time + simplify_time + heuristic_time)
+        # Convert to percentages
+        regular_pct = (regular_time / total_time) * 100
+        simplify_pct = (simplify_time / total_time) * 100
+        heuristic_pct = (heuristic_time / total_time) * 100
+        other_pct = (other_time / total_time) * 100
+        return regular_pct, simplify_pct, heuristic_pct, other_pct
+    else:
+        # Missing data; ignore this log file
+        return None
+
+def extract_times_from_events(file_path):
+    """Compute the same percentages as `extract_times_from_log` from the events written with --telemetry."""
+    summary = read_summary(file_path)
+    # like the logs, only count runs that finished on their own
+    if summary is None or summary.outcome == "Timeout" or summary.synthesis_time <= 0:
+        return None
+    total_time = summary.synthesis_time
+    regular_time = summary.query_times["Regular"]
+    simplify_time = summary.query_times["Simplify"]
+    heuristic_time = summary.query_times["Heuristic"]
+    other_time = total_time - (regular_time + simplify_time + heuristic_time)
+    return (regular_time / total_time * 100, simplify_time / total_time * 100,
+            heuristic_time / total_time * 100, other_time / total_time * 100)
+
+def extract_times(file_path):
+    """Extract time data from either an events file or a log file."""
+    if file_path.endswith(EVENTS_EXTENSION):
+        return extract_times_from_events(file_path)
+    return extract_times_from_log(file_path)
+
+def find_log_files(log_dir):
+    """Recursively list the log files of regular synthesis problems, with their stat results.
+
+    Where a run also wrote events, only the events file is listed, since it has the same data without the parsing."""
+    log_files = []
+    pending = [log_dir]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif (entry.name.endswith('.log') or entry.name.endswith(EVENTS_EXTENSION)) and \
+                        not any(excluded in entry.path for excluded in EXCLUDED_LOGS):
+                    log_files.append((entry.path, entry.stat()))
+    events_files = {f.removesuffix(EVENTS_EXTENSION) for f, _ in log_files if f.endswith(EVENTS_EXTENSION)}
+    return [(f, stat) for f, stat in log_files if f.removesuffix('.log') not in events_files]
+
+def load_index(index_file):
+    """Load the per-log summaries computed by previous runs."""
+    try:
+        with open(index_file, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_index(index_file, index):
+    """Atomically replace the index, so that an interrupted run cannot corrupt it."""
+    directory = os.path.dirname(index_file) or '.'
+    os.makedirs(directory, exist_ok=True)
+    temporary_file = f'{index_file}.{os.getpid()}.tmp'
+    with open(temporary_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(temporary_file, index_file)
+
+def extract_all_times(log_files, index_file, jobs):
+    """Extract time data from all log files, only parsing those that are new or have changed since the last run."""
+    index = load_index(index_file) if index_file else {}
+    times = {}
+    stale = []
+    for f, stat in log_files:
+        key = os.path.abspath(f)
+        entry = index.get(key)
+        if entry is not None and entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            times[f] = entry['times']
         else:
-            # Missing data; ignore this log file
-            return None
+            stale.append((f, key, stat))
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parsed = executor.map(extract_times, [f for f, _, _ in stale], chunksize=16)
+            for (f, key, stat), result in zip(stale, parsed):
+                times[f] = result
+                index[key] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'times': result}
+        if index_file:
+            save_index(index_file, index)
+    return times
 
-def main(log_dir):
+def main(log_dir, index_file=DEFAULT_INDEX_FILE, jobs=None):
     # Step 1: Get all log filenames while excluding certain files
-    log_files = glob.glob(f'{log_dir}/**/*.log', recursive=True)
-    log_files = [f for f in log_files if len([prohibit for prohibit in 
-        ["Definitions", "StartUp", # These are not log files with regular synthesis problems
-         # we don't want the first two (one? three?) problems, since they are simple and disproportionally affect everything]
-         "Problem00", "Problem01"]
-        if prohibit in f]) == 0]
+    log_files = find_log_files(log_dir)
     
     # Step 2: Group filenames by benchmark
     benchmark_files = defaultdict(list)
-    for f in log_files:
+    for f, _ in log_files:
         benchmark_name = extract_benchmark_name(f)
         if benchmark_name:
             benchmark_files[benchmark_name].append(f)
     
     # Step 3: Process each benchmark's log files
+    all_times = extract_all_times(
+        [(f, stat) for f, stat in log_files if extract_benchmark_name(f)], index_file, jobs)
     benchmark_data = {}
     for benchmark, files in benchmark_files.items():
         regular_pcts = []
@@ -115,7 +207,7 @@ def main(log_dir):
         other_pcts = []
         
         for f in sorted(files):
-            times = extract_times_from_log(f)
+            times = all_times[f]
             if times:
                 regular_pct, simplify_pct, heuristic_pct, other_pct = times
                 regular_pcts.append(regular_pct)
@@ -194,9 +286,16 @@ def main(log_dir):
 
 
 if __name__ == "__main__":
-    p = argparse.ArgumentParser(description="Generate running time breakdown figure from the logs Metamorph produces.")
+    p = argparse.ArgumentParser(
+        description="Generate running time breakdown figure from the logs (or events) Metamorph produces.")
     p.add_argument('-logs',
                    help=f"The directory with logs.",
                    required=True)
+    p.add_argument('-index', default=DEFAULT_INDEX_FILE,
+                   help=f"File in which to keep the summaries of already parsed logs, "
+                        f"so that only new or modified logs are parsed again (default: {DEFAULT_INDEX_FILE}). "
+                        f"Pass an empty string to disable the index.")
+    p.add_argument('-jobs', type=int, default=None,
+                   help=f"Number of processes used to parse logs (default: number of CPUs).")
     args = p.parse_args(sys.argv[1:])
-    main(args.logs)
\ No newline at end of file
+    main(args.logs, args.index, args.jobs)
\ No newline at end of file
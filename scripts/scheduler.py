@@ -0,0 +1,189 @@
+import threading
+
+from process_timing import kill_process_group
+
+
+class Job:
+    """A unit of work executed by one of the scheduler's workers.
+
+    `run(job)` performs the work and returns its result. It should hand every
+    process it spawns to `job.attach` so that the scheduler can kill it if the
+    job is cancelled. `commit(result)` is called once the result is final,
+    in the order of the job's chain and never concurrently with another commit.
+    A job with `after` set to an earlier job of the same chain only starts once that
+    job has finished, e.g. to run the stages of a pipeline in order. `memory` is the
+    peak memory (in bytes) the job is expected to use, if known, and `memory_limit`
+    the memory its processes are killed for exceeding."""
+
+    def __init__(self, name, run, commit=None, after=None, memory=None, memory_limit=None):
+        self.name = name
+        self.run = run
+        self.commit = commit
+        self.after = after
+        self.memory = memory
+        self.memory_limit = memory_limit
+        self.finished = False
+        self.cancelled = threading.Event()
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def attach(self, process):
+        with self._lock:
+            self._processes.append(process)
+        if self.cancelled.is_set():
+            kill_process_group(process.pid)
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_group(process.pid)
+
+
+class Chain:
+    """An ordered sequence of jobs, e.g. all problems of a benchmark processed with one method.
+
+    Jobs may run ahead of each other (if the chain is speculative) but their results are committed
+    in order. Once a committed result satisfies `stops_chain`, the remaining jobs are cancelled
+    and their results discarded. A chain only starts once the chain it depends on has finished."""
+
+    def __init__(self, jobs, stops_chain=lambda result: False, depends_on=None, speculative=True):
+        self.jobs = jobs
+        self.stops_chain = stops_chain
+        self.depends_on = depends_on
+        self.speculative = speculative
+        self.stopped = False
+        self._next = 0  # index of the next job to dispatch
+        self._committed = 0  # number of jobs whose results have been committed
+        self._results = {}
+        self._running = {}
+
+    @property
+    def done(self):
+        return self.stopped or self._committed == len(self.jobs)
+
+    def _runnable(self):
+        if self.done or self._next == len(self.jobs):
+            return False
+        if self.depends_on is not None and not self.depends_on.done:
+            return False
+        after = self.jobs[self._next].after
+        if after is not None and not after.finished:
+            return False
+        return self.speculative or len(self._running) == 0
+
+    def _dispatch(self):
+        index = self._next
+        self._next += 1
+        self._running[index] = self.jobs[index]
+        return index
+
+    def _finish(self, index, result):
+        del self._running[index]
+        self.jobs[index].finished = True
+        if self.stopped:
+            return  # the job was cancelled, so its result is stale
+        self._results[index] = result
+        while self._committed in self._results:
+            result = self._results.pop(self._committed)
+            job = self.jobs[self._committed]
+            self._committed += 1
+            if job.commit is not None:
+                job.commit(result)
+            if self.stops_chain(result):
+                self.stopped = True
+                self._results.clear()
+                for running in self._running.values():
+                    running.cancel()
+                break
+
+
+class Scheduler:
+    """Runs chains of jobs on a pool of worker threads.
+
+    Workers prefer chains with the fewest jobs in flight (ties are broken by the order in which
+    the chains were added), so with a single worker the chains run one after another, exactly
+    as a sequential loop would, and with more workers the pool first spreads across chains
+    before speculatively running ahead within a chain.
+
+    With a `memory_budget` (in bytes), a job only starts while the expected memory of all running
+    jobs, its own included, fits into the budget. Jobs of unknown memory use are assumed to need
+    none, and a job that does not fit on its own still starts once nothing else is running."""
+
+    def __init__(self, jobs=1, memory_budget=None):
+        self.jobs = max(1, jobs)
+        self.memory_budget = memory_budget
+        self.chains = []
+        self._condition = threading.Condition()
+        self._error = None
+
+    def add_chain(self, chain):
+        self.chains.append(chain)
+        return chain
+
+    def run(self):
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if self._error is not None:
+            raise self._error
+
+    def _finished(self):
+        return self._error is not None or \
+            all(chain.done and len(chain._running) == 0 for chain in self.chains)
+
+    def _fits(self, job):
+        if self.memory_budget is None:
+            return True
+        running = [other for chain in self.chains for other in chain._running.values()]
+        if not running:
+            return True
+        return sum(other.memory or 0 for other in running) + (job.memory or 0) <= self.memory_budget
+
+    def _pick(self):
+        candidates = [(len(chain._running), position, chain)
+                      for position, chain in enumerate(self.chains)
+                      if chain._runnable() and self._fits(chain.jobs[chain._next])]
+        if not candidates:
+            return None
+        _, _, chain = min(candidates, key=lambda candidate: candidate[:2])
+        return chain, chain._dispatch()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                picked = self._pick()
+                while picked is None:
+                    if self._finished():
+                        return
+                    self._condition.wait()
+                    picked = self._pick()
+            chain, index = picked
+            job = chain.jobs[index]
+            error = None
+            result = None
+            try:
+                result = job.run(job)
+            except BaseException as exception:
+                # a cancelled job may fail in arbitrary ways, but its result is discarded anyway
+                if not job.cancelled.is_set():
+                    error = exception
+            with self._condition:
+                if error is not None:
+                    self._abort(error)
+                try:
+                    chain._finish(index, result)
+                except BaseException as exception:
+                    self._abort(exception)
+                self._condition.notify_all()
+
+    def _abort(self, error):
+        self._error = self._error or error
+        for chain in self.chains:
+            chain.stopped = True
+            for running in chain._running.values():
+                running.cancel()
+
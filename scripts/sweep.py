@@ -0,0 +1,364 @@
+import argparse
+import fcntl
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+
+from evaluate import BENCHMARK_CHOICES, BENCHMARKS_DIR, LOGS_DIR, METHOD_NAMES, PRETRAINED_DIR, PRETRAINED_METHODS, \
+    SCRATCH_DIR, STOPPING_OUTCOMES, Method, append_result, benchmark_methods, cached_result, generate_baseline_tests, \
+    open_results_cache, problem_index, result_fingerprint, run_problem, schedule_pretraining, select_benchmarks, \
+    test_baseline
+from results_cache import Result
+from scheduler import Job, Scheduler
+
+DEFAULT_QUEUE = "cache/sweep"
+DEFAULT_LEASE = 60
+# a job whose worker disappeared this many times is given up on, e.g. because it crashes the machine
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5
+
+
+class Queue:
+    """A durable queue of runs, stored in an SQLite database in a directory that all workers can reach.
+
+    Every row is one run of a method on a problem. The runs of a method on a benchmark (and repetition) form a chain
+    ordered by the problem index, like the chains of evaluate.py: they may run out of order on different workers,
+    but once a run times out or runs out of memory, the runs after it are pruned, and results are only merged in
+    the order of the chain, so that a sweep records exactly what evaluate.py would have. A worker holds a lease on
+    the run it claimed and renews it while the run is going; a run whose lease expired is claimed again."""
+
+    COLUMNS = ["id", "benchmark", "time_limit", "method", "problem", "repeat", "position", "chain", "fingerprint",
+               "memory_limit", "search_jobs", "state", "worker", "lease_expires", "attempts",
+               "outcome", "running_time", "cpu_time", "peak_rss", "strategy", "merged"]
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.logs_dir = f"{directory}/logs"
+        os.makedirs(self.logs_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # the default rollback journal, since WAL does not work on network file systems
+        self._connection = sqlite3.connect(f"{directory}/queue.db", timeout=60, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, benchmark TEXT NOT NULL, time_limit INTEGER NOT NULL, "
+            "method TEXT NOT NULL, problem TEXT NOT NULL, repeat INTEGER NOT NULL, position INTEGER NOT NULL, "
+            "chain TEXT NOT NULL, fingerprint TEXT NOT NULL, memory_limit INTEGER, search_jobs INTEGER NOT NULL, "
+            "state TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_expires REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, outcome TEXT, running_time REAL, cpu_time REAL, peak_rss INTEGER, "
+            "strategy TEXT, merged INTEGER NOT NULL DEFAULT 0, "
+            "UNIQUE (benchmark, time_limit, method, problem, fingerprint))")
+
+    def _transaction(self, work):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._connection)
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+            return result
+
+    def _rows(self, query, parameters=()):
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs {query}",
+                                            parameters).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def add(self, jobs):
+        """Add runs that are not in the queue yet, returns how many were added."""
+        def add(connection):
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (benchmark, time_limit, method, problem, repeat, position, chain, "
+                "fingerprint, memory_limit, search_jobs) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", jobs)
+            return connection.total_changes - before
+
+        return self._transaction(add)
+
+    def claim(self, worker, lease):
+        """Reserve the next run for a worker, or return None if no run is waiting.
+
+        The smallest problems of all chains go first, so that a chain is pruned before its larger problems start."""
+        def claim(connection):
+            now = time.time()
+            connection.execute("UPDATE jobs SET state = 'abandoned' WHERE state = 'running' AND lease_expires < ? "
+                               "AND attempts >= ?", (now, MAX_ATTEMPTS))
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE state = 'pending' OR (state = 'running' AND lease_expires < ?) "
+                "ORDER BY position, id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE jobs SET state = 'running', worker = ?, lease_expires = ?, "
+                               "attempts = attempts + 1 WHERE id = ?", (worker, now + lease, row[0]))
+            return row[0]
+
+        job_id = self._transaction(claim)
+        return None if job_id is None else self._rows("WHERE id = ?", (job_id,))[0]
+
+    def renew(self, job_id, worker, lease):
+        """Extend the lease on a run, returns False if the worker lost it (the run was pruned or claimed again)."""
+        return self._transaction(lambda connection: connection.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'running'",
+            (time.time() + lease, job_id, worker)).rowcount > 0)
+
+    def release(self, job_id, worker):
+        """Give a run back without a result, e.g. when the worker is interrupted."""
+        self._transaction(lambda connection: connection.execute(
+            "UPDATE jobs SET state = 'pending', worker = NULL, lease_expires = NULL, attempts = attempts - 1 "
+            "WHERE id = ? AND worker = ? AND state = 'running'", (job_id, worker)))
+
+    def finish(self, job, worker, result):
+        """Record the result of a run, returns False if the worker lost its lease and the result was dropped."""
+        def finish(connection):
+            finished = connection.execute(
+                "UPDATE jobs SET state = 'done', outcome = ?, running_time = ?, cpu_time = ?, peak_rss = ?, "
+                "strategy = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (result.outcome, result.running_time, result.cpu_time, result.peak_rss, result.strategy,
+                 job["id"], worker)).rowcount > 0
+            if finished and result.outcome in STOPPING_OUTCOMES:
+                # runs that are still going notice when they renew their lease
+                connection.execute("UPDATE jobs SET state = 'pruned' WHERE chain = ? AND position > ? "
+                                   "AND state IN ('pending', 'running')", (job["chain"], job["position"]))
+            return finished
+
+        return self._transaction(finish)
+
+    def mergeable(self):
+        """The results that are final but not merged yet: those whose chain has a result for every earlier run,
+        none of which stopped the chain. Runs that were given up on are missing from the results."""
+        mergeable = []
+        chain = None
+        blocked = False
+        for job in self._rows("ORDER BY chain, position"):
+            if job["chain"] != chain:
+                chain = job["chain"]
+                blocked = False
+            if blocked or job["state"] == "abandoned":
+                continue
+            if job["state"] != "done":
+                blocked = True
+                continue
+            if not job["merged"]:
+                mergeable.append(job)
+            blocked = job["outcome"] in STOPPING_OUTCOMES
+        return mergeable
+
+    def mark_merged(self, job_id):
+        self._transaction(lambda connection: connection.execute("UPDATE jobs SET merged = 1 WHERE id = ?", (job_id,)))
+
+    def active(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'running')").fetchone()[0] > 0
+
+    def counts(self):
+        with self._lock:
+            return dict(self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+
+class Heartbeat:
+    """Renews the lease on a run while it is going, and cancels the run as soon as the lease is lost."""
+
+    def __init__(self, queue, job, worker, lease, running):
+        self.queue = queue
+        self.job = job
+        self.worker = worker
+        self.lease = lease
+        self.running = running
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+
+    def _beat(self):
+        while not self._stopped.wait(self.lease / 4):
+            if not self.queue.renew(self.job["id"], self.worker, self.lease):
+                print(f"Lost the lease on {self.running.name}, so cancelling it.")
+                self.running.cancel()
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def coordinate(queue, time_limit, benchmarks, methods=None, repeats=1, memory_limit=None, search_jobs=1):
+    # like evaluate.py, runs with a cached result are skipped, and so are the runs after a cached timeout
+    results_cache = open_results_cache()
+    jobs = []
+    for benchmark in benchmarks:
+        for repeat in range(repeats):
+            for method in benchmark_methods(benchmark, methods):
+                chain = f"{benchmark}/{method}/{time_limit}/{repeat}/{search_jobs}"
+                for position, line in enumerate(problem_index(benchmark)[1:]):
+                    problem = line[1]
+                    result_key = (benchmark, time_limit, method, problem,
+                                  result_fingerprint(benchmark, method, problem, repeat=repeat,
+                                                     search_jobs=search_jobs))
+                    cached = cached_result(results_cache, result_key, memory_limit)
+                    if cached is not None and cached.outcome in STOPPING_OUTCOMES:
+                        break
+                    if cached is None:
+                        jobs.append((*result_key[:4], repeat, position, chain, result_key[4], memory_limit,
+                                     search_jobs))
+    added = queue.add(jobs)
+    print(f"Added {added} runs to the queue in {queue.directory} ({len(jobs) - added} were queued already).")
+
+
+def ensure_pretrained(benchmark, results_cache):
+    # workers on the same machine share the pretrained data, so only one of them pretrains
+    os.makedirs(PRETRAINED_DIR, exist_ok=True)
+    with open(f"{PRETRAINED_DIR}/{benchmark}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        scheduler = Scheduler()
+        schedule_pretraining(benchmark, results_cache, scheduler, None)
+        scheduler.run()
+
+
+def run_job(job, running):
+    benchmark, method, problem, time_limit = job["benchmark"], job["method"], job["problem"], job["time_limit"]
+    if method == Method.BASELINE:
+        config = problem_index(benchmark)
+        line = next(line for line in config[1:] if line[1] == problem)
+        generation, artifact_dir = generate_baseline_tests(f"{BENCHMARKS_DIR}/{benchmark}/", config[0], line,
+                                                           time_limit, running, job["repeat"])
+        return test_baseline(artifact_dir, generation, time_limit, running)
+    return run_problem(benchmark, method, problem, time_limit, running, None, search_jobs=job["search_jobs"])
+
+
+def push_logs(queue, job, started):
+    # Metamorph names its logs after the input file, with the directory separators replaced
+    stage = f"{BENCHMARKS_DIR}/{job['benchmark']}/{job['problem']}".replace("/", "$")
+    if not os.path.isdir(LOGS_DIR):
+        return
+    for name in os.listdir(LOGS_DIR):
+        path = f"{LOGS_DIR}/{name}"
+        if stage in name and os.path.getmtime(path) >= started:
+            shutil.copyfile(path, f"{queue.logs_dir}/{name}.tmp")
+            os.replace(f"{queue.logs_dir}/{name}.tmp", f"{queue.logs_dir}/{name}")
+
+
+def work(queue, lease=DEFAULT_LEASE):
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    # only used for pretraining, which every machine does for itself
+    results_cache = open_results_cache()
+    pretrained = set()
+    processed = 0
+    while True:
+        job = queue.claim(worker, lease)
+        if job is None:
+            if not queue.active():
+                break
+            time.sleep(POLL_INTERVAL)  # runs of other workers may still be given back
+            continue
+        description = f"{job['method']} on {job['benchmark']}/{job['problem']}" + \
+                      (f" (repetition {job['repeat'] + 1})" if job["repeat"] > 0 else "")
+        fingerprint = result_fingerprint(job["benchmark"], job["method"], job["problem"], repeat=job["repeat"],
+                                         search_jobs=job["search_jobs"])
+        if fingerprint != job["fingerprint"]:
+            queue.release(job["id"], worker)
+            print(f"The sources or binaries for {description} differ from those of the coordinator, "
+                  f"so this worker stops.")
+            return False
+        running = Job(description, lambda running: run_job(job, running), memory_limit=job["memory_limit"])
+        heartbeat = Heartbeat(queue, job, worker, lease, running)
+        started = time.time()
+        try:
+            if job["method"] in PRETRAINED_METHODS and job["benchmark"] not in pretrained:
+                ensure_pretrained(job["benchmark"], results_cache)
+                pretrained.add(job["benchmark"])
+            print(f"Running {description} with time limit of {job['time_limit']} seconds...")
+            result = running.run(running)
+        except BaseException:
+            if not running.cancelled.is_set():
+                queue.release(job["id"], worker)
+                raise
+            result = None  # a cancelled run may fail in arbitrary ways, but its result is dropped anyway
+        finally:
+            heartbeat.stop()
+        push_logs(queue, job, started)
+        if result is None or running.cancelled.is_set() or not queue.finish(job, worker, result):
+            print(f"Dropped the result of {description}, which is no longer needed.")
+            continue
+        processed += 1
+        print(f"Running {description} with time limit of {job['time_limit']} seconds took {result.describe()}")
+    print(f"Processed {processed} runs, the queue in {queue.directory} is empty.")
+    return True
+
+
+def merge(queue):
+    results_cache = open_results_cache()
+    jobs = queue.mergeable()
+    for job in jobs:
+        result = Result(job["outcome"], job["running_time"], job["cpu_time"], job["peak_rss"], strategy=job["strategy"])
+        append_result(job["benchmark"], job["time_limit"], job["method"], job["problem"], result)
+        results_cache.store(job["benchmark"], job["time_limit"], job["method"], job["problem"], job["fingerprint"],
+                            result)
+        queue.mark_merged(job["id"])
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    logs = 0
+    for name in os.listdir(queue.logs_dir):
+        source = f"{queue.logs_dir}/{name}"
+        if name.endswith(".tmp") or (os.path.exists(f"{LOGS_DIR}/{name}") and
+                                     os.path.getsize(f"{LOGS_DIR}/{name}") == os.path.getsize(source)):
+            continue
+        shutil.copyfile(source, f"{LOGS_DIR}/{name}")
+        logs += 1
+    counts = queue.counts()
+    print(f"Merged {len(jobs)} results and {logs} logs. The queue has " +
+          ", ".join(f"{counts.get(state, 0)} {state}" for state in
+                    ["pending", "running", "done", "pruned", "abandoned"]) + " runs.")
+
+
+if __name__ == "__main__":
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-queue", default=DEFAULT_QUEUE,
+                        help=f"Directory of the queue, which all workers have to reach, e.g. on a shared file system "
+                             f"(default: {DEFAULT_QUEUE}).")
+    p = argparse.ArgumentParser(
+        description="Split the experiments of evaluate.py between several machines. The coordinator queues the "
+                    "runs, workers (any number, on any machine with the same sources and binaries) run them, and "
+                    "merge adds their results and logs to those of this machine.")
+    commands = p.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinator", parents=[common],
+                                      help="Queue the runs of evaluate.py that have no cached result yet.")
+    coordinator.add_argument("-timeLimit", type=int,
+                             help=f"Time limit (in seconds) after which the process will be killed on each "
+                                  f"synthesis problem.",
+                             required=True)
+    coordinator.add_argument("-benchmark", choices=BENCHMARK_CHOICES,
+                             help=f"The benchmark to run the experiments on.",
+                             required=True)
+    coordinator.add_argument("-methods", nargs="+", choices=list(METHOD_NAMES.keys()),
+                             help=f"Only run the given methods (by default, those in the paper's figures).")
+    coordinator.add_argument("-repeats", type=int, default=1,
+                             help=f"Run every problem this many times (see evaluate.py).")
+    coordinator.add_argument("-memoryLimit", type=float, metavar="GIB",
+                             help=f"Memory (in GiB) that a run may use (see evaluate.py).")
+    coordinator.add_argument("-searchJobs", type=int, default=1,
+                             help=f"Number of Dafny queries Metamorph runs in parallel while expanding a node of "
+                                  f"its search (see evaluate.py).")
+    worker = commands.add_parser("worker", parents=[common],
+                                 help="Run queued runs one at a time until the queue is empty.")
+    worker.add_argument("-lease", type=int, default=DEFAULT_LEASE,
+                        help=f"Seconds after which the run of a worker that stopped responding is given to another "
+                             f"worker (default: {DEFAULT_LEASE}).")
+    commands.add_parser("merge", parents=[common],
+                        help="Add the results and logs of finished runs to cache/Results.csv and cache/logs.")
+    args = p.parse_args(sys.argv[1:])
+    queue = Queue(args.queue)
+    if args.command == "coordinator":
+        methods = [METHOD_NAMES[name] for name in args.methods] if args.methods else None
+        memory_limit = int(args.memoryLimit * 2**30) if args.memoryLimit is not None else None
+        coordinate(queue, args.timeLimit, select_benchmarks(args.benchmark), methods, args.repeats, memory_limit,
+                   args.searchJobs)
+    elif args.command == "worker":
+        sys.exit(0 if work(queue, args.lease) else 1)
+    else:
+        merge(queue)
@@ -0,0 +1,51 @@
+import json
+import os
+
+EVENTS_EXTENSION = ".events.jsonl"
+QUERY_TYPES = ["Regular", "Simplify", "Heuristic"]
+
+
+class Summary:
+    """What a Metamorph run reported in its "end" event (see Telemetry.cs)."""
+
+    def __init__(self, outcome, synthesis_time, query_counts, query_times, strategy=None):
+        self.outcome = outcome  # "Success", "Timeout", or "Fail"
+        self.synthesis_time = synthesis_time
+        self.query_counts = query_counts
+        self.query_times = query_times
+        self.strategy = strategy  # the name of the strategy if the run was part of a portfolio
+
+
+def read_events(path):
+    """Yield the events in a file written with Metamorph's --telemetry option.
+
+    A run that was killed may leave an incomplete last line behind, which is skipped."""
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_summary(path):
+    """The summary of a finished run, or None if the run did not finish (e.g. it was killed)."""
+    strategy = None
+    for event in read_events(path):
+        if event["event"] == "start":
+            strategy = event.get("strategy")
+        elif event["event"] == "end":
+            queries = event["queries"]
+            return Summary(event["outcome"], event["seconds"],
+                           {query_type: queries[query_type]["count"] for query_type in QUERY_TYPES},
+                           {query_type: queries[query_type]["seconds"] for query_type in QUERY_TYPES},
+                           strategy)
+    return None
+
+
+def find_events_files(directory):
+    """The events files Metamorph wrote to a directory that was passed to --telemetry, oldest first.
+
+    A single run writes one file, a run with --portfolio one file for each of its strategies."""
+    files = [entry.path for entry in os.scandir(directory) if entry.name.endswith(EVENTS_EXTENSION)]
+    return sorted(files, key=os.path.getmtime)